@@ -1,6 +1,10 @@
 """The buffer module assists in iterating through lines and tokens."""
 
 import math
+from collections import deque
+
+# The number of recent lines that a Buffer keeps for its diagnostics
+HISTORY = 4
 
 class Buffer:
     """A Buffer provides a way of accessing a sequence of tokens across lines.
@@ -16,8 +20,10 @@ class Buffer:
     In addition, Buffer provides a current method to look at the
     next item to be supplied, without sequencing past it.
 
-    The __str__ method prints all tokens read so far, up to the end of the
-    current line, and marks the current token with >>.
+    The __str__ method prints the tokens of the last few lines read, up to the
+    end of the current line, and marks the current token with >>.  Only those
+    HISTORY lines are kept, so a Buffer uses constant memory however long its
+    source is.
 
     >>> buf = Buffer(iter([['(', '+'], [15], [12, ')']]))
     >>> buf.pop()
@@ -46,12 +52,27 @@ class Buffer:
     2: 15
     3: 12 ) >>
     >>> buf.pop()  # returns None
+
+    If the source also appends the columns of the items on each line to a
+    list COLUMNS as it returns that line, the Buffer takes them from COLUMNS
+    and can report the position of its current item.
+
+    >>> from scheme_tokens import tokenize_lines
+    >>> columns = []
+    >>> buf = Buffer(tokenize_lines(["(+", "  15)"], columns), columns)
+    >>> buf.pop(), buf.position()
+    ('(', (1, 1))
+    >>> buf.pop(), buf.position()
+    ('+', (2, 2))
     """
-    def __init__(self, source):
+    def __init__(self, source, columns=None):
         self.index = 0
-        self.lines = []
+        self.lines = deque(maxlen=HISTORY)
+        self.line_count = 0
         self.source = source
+        self.columns = columns
         self.current_line = ()
+        self.current_columns = ()
         self.current()
 
     def pop(self):
@@ -61,6 +82,12 @@ class Buffer:
         self.index += 1
         return current
 
+    def position(self):
+        """Return the line number and column of the current item, which must
+        exist, if columns are tracked."""
+        self.current()
+        return self.line_count, self.current_columns[self.index]
+
     @property
     def more_on_line(self):
         return self.index < len(self.current_line)
@@ -72,6 +99,9 @@ class Buffer:
             try:
                 self.current_line = next(self.source)
                 self.lines.append(self.current_line)
+                self.line_count += 1
+                if self.columns is not None:
+                    self.current_columns = self.columns.pop()
             except StopIteration:
                 self.current_line = ()
                 return None
@@ -80,13 +110,14 @@ class Buffer:
     def __str__(self):
         """Return recently read contents; current element marked with >>."""
         # Format string for right-justified line numbers
-        n = len(self.lines)
+        n = self.line_count
         msg = '{0:>' + str(math.floor(math.log10(n))+1) + "}: "
 
         # Up to three previous lines and current line are included in output
         s = ''
-        for i in range(max(0, n-4), n-1):
-            s += msg.format(i+1) + ' '.join(map(str, self.lines[i])) + '\n'
+        previous = list(self.lines)[:-1]
+        for i, line in enumerate(previous, n - len(previous)):
+            s += msg.format(i) + ' '.join(map(str, line)) + '\n'
         s += msg.format(n)
         s += ' '.join(map(str, self.current_line[:self.index]))
         s += ' >> '
@@ -110,15 +141,20 @@ class InputReader:
             self.prompt = ' ' * len(self.prompt)
 
 class LineReader:
-    """A LineReader is an iterable that prints lines after a prompt."""
+    """A LineReader is an iterable that prints lines after a prompt.
+
+    LINES is an iterator, such as an open file, and each line is consumed from
+    it only when it is read, so successive LineReaders for the same LINES
+    continue where the last one stopped.
+    """
     def __init__(self, lines, prompt, comment=";"):
         self.lines = lines
         self.prompt = prompt
         self.comment = comment
 
     def __iter__(self):
-        while self.lines:
-            line = self.lines.pop(0).strip('\n')
+        for line in self.lines:
+            line = line.strip('\n')
             if (self.prompt is not None and line != "" and
                 not line.lstrip().startswith(self.comment)):
                 print(self.prompt + line)
@@ -111,7 +111,7 @@ def get_unique_id():
 def rename_variables(expr, n):
     """Rename all variables in expr with an identifier N."""
     if isvar(expr):
-        return expr + '_' + str(n)
+        return Symbol(expr + '_' + str(n))
     elif scheme_pairp(expr):
         return Pair(rename_variables(expr.first, n),
                     rename_variables(expr.second, n))
@@ -6,6 +6,24 @@ from scheme_primitives import *
 from scheme_reader import *
 from ucb import main, trace
 
+import collections
+import hashlib
+import os
+import pickle
+import sys
+import time
+
+# Modules that extend the interpreter import it as scheme, even when this
+# file is run as a script.
+sys.modules.setdefault('scheme', sys.modules[__name__])
+
+# Symbols that name special forms
+AND, BEGIN, COND, DEFINE, DEFINE_MEMOIZED, ELSE, IF, LAMBDA, LET, MU, OR = map(
+    Symbol, ["and", "begin", "cond", "define", "define-memoized", "else", "if",
+             "lambda", "let", "mu", "or"])
+CONS_STREAM, DELAY, DELAY_FORCE = map(
+    Symbol, ["cons-stream", "delay", "delay-force"])
+
 ##############
 # Eval/Apply #
 ##############
@@ -37,15 +55,21 @@ def scheme_eval(expr, env):
     if (scheme_symbolp(first) # first might be unhashable
         and first in LOGIC_FORMS):
         return scheme_eval(LOGIC_FORMS[first](rest, env), env)
-    elif first == "lambda":
+    elif first is LAMBDA:
         return do_lambda_form(rest, env)
-    elif first == "mu":
+    elif first is MU:
         return do_mu_form(rest)
-    elif first == "define":
+    elif first is DEFINE:
         return do_define_form(rest, env)
-    elif first == "quote":
+    elif first is DEFINE_MEMOIZED:
+        return do_define_form(memoized_definition(rest), env)
+    elif first is QUOTE:
         return do_quote_form(rest)
-    elif first == "let":
+    elif first is DELAY or first is DELAY_FORCE:
+        return do_delay_form(rest, env, first is DELAY_FORCE)
+    elif first is CONS_STREAM:
+        return scheme_eval(stream_pair(rest), env)
+    elif first is LET:
         expr, env = do_let_form(rest, env)
         return scheme_eval(expr, env)
     else:
@@ -55,14 +79,28 @@ def scheme_eval(expr, env):
 
 
 def scheme_apply(procedure, args, env):
-    """Apply Scheme PROCEDURE to argument values ARGS in environment ENV."""
+    """Apply Scheme PROCEDURE to argument values ARGS in environment ENV.
+
+    >>> env = create_global_frame()
+    >>> square = scheme_eval(read_line("(lambda (x) (* x x))"), env)
+    >>> scheme_apply(square, read_line("(12)"), env)
+    144
+    """
     if isinstance(procedure, PrimitiveProcedure):
         return apply_primitive(procedure, args, env)
+    elif isinstance(procedure, (LambdaProcedure, MuProcedure)) and (
+            procedure.analyzed is not None or
+            scheme_eval is scheme_analyzed_eval):
+        # Run the body analyzed once rather than analyzing it on every call
+        check_type(args, scheme_listp, 1, "apply")
+        return analyzed_apply(procedure, list_elements(args), env)
     elif isinstance(procedure, LambdaProcedure):
-        new_env = procedure.env.make_call_frame(procedure.formals, args)
+        new_env = procedure.env.make_call_frame(procedure.formals, args,
+                                                call_scope(procedure))
         return scheme_eval(procedure.body, new_env)
     elif isinstance(procedure, MuProcedure):
-        new_env = env.make_call_frame(procedure.formals, args)
+        new_env = env.make_call_frame(procedure.formals, args,
+                                      call_scope(procedure))
         return scheme_eval(procedure.body, new_env)
     else:
         raise SchemeError("Cannot call {0}".format(str(procedure)))
@@ -80,12 +118,7 @@ def apply_primitive(procedure, args, env):
     while args is not nil:
         lst.append (args.first)
         args = args.second
-    if procedure.use_env:
-        lst.append (env)
-    try:
-        return procedure.fn(*lst)
-    except TypeError:
-        raise SchemeError
+    return procedure.apply(lst, env)
 
 ################
 # Environments #
@@ -94,8 +127,14 @@ def apply_primitive(procedure, args, env):
 class Frame:
     """An environment frame binds Scheme symbols to Scheme values."""
 
+    __slots__ = ("bindings", "parent")
+
+    # The number of local frames enclosing this one
+    depth = 0
+
     def __init__(self, parent):
         """An empty frame with a PARENT frame (that may be None)."""
+        stats.frames += 1
         self.bindings = {}
         self.parent = parent
 
@@ -125,33 +164,105 @@ class Frame:
             e = e.parent
         return e
 
-    def make_call_frame(self, formals, vals):
+    def make_call_frame(self, formals, vals, scope=None):
         """Return a new local frame whose parent is SELF, in which the symbols
         in the Scheme formal parameter list FORMALS are bound to the Scheme
         values in the Scheme value list VALS. Raise an error if too many or too
-        few arguments are given.
+        few arguments are given. SCOPE, if given, is the Scope of FORMALS.
 
         >>> env = create_global_frame()
         >>> formals, vals = read_line("(a b c)"), read_line("(1 2 3)")
         >>> env.make_call_frame(formals, vals)
         <{a: 1, b: 2, c: 3} -> <Global Frame>>
         """
-        frame = Frame(self)
-
-        if len(formals) > len(vals):
-            raise SchemeError ("Not enough values")
-        if len(formals) < len(vals):
-            raise SchemeError ("Not enough symbols")
-        while formals is not nil and vals is not nil:
-            frame.define(formals.first, vals.first)
-            formals = formals.second
+        if scope is None:
+            scope = Scope(formals, (), frame_scope(self))
+        args = []
+        while vals is not nil:
+            args.append(vals.first)
             vals = vals.second
-        return frame
+        return bind_arguments(self, scope, args)
 
     def define(self, sym, val):
         """Define Scheme symbol SYM to have value VAL in SELF."""
         self.bindings[sym] = val
 
+class unassigned:
+    """The value of a name in a CallFrame before its definition is evaluated."""
+    def __repr__(self):
+        return "unassigned"
+
+unassigned = unassigned() # Assignment hides the class; there is only one instance
+
+class CallFrame(Frame):
+    """A local frame that stores the values of the names in its Scope (see
+    the Analysis section below) in a Python list indexed by slot, so that
+    analyzed code can look up local names by position. Names outside its
+    Scope may still be defined by name, and are then kept in EXTRAS."""
+
+    __slots__ = ("scope", "values", "extras", "depth")
+
+    def __init__(self, parent, scope, values):
+        """A frame with a PARENT frame whose names are described by SCOPE and
+        whose values are in the list VALUES, which has one slot per name."""
+        stats.frames += 1
+        depth = self.depth = parent.depth + 1
+        if depth > stats.peak_depth:
+            stats.peak_depth = depth
+        self.parent = parent
+        self.scope = scope
+        self.values = values
+        self.extras = None
+
+    @property
+    def bindings(self):
+        """A dictionary of the names currently bound in this frame."""
+        bindings = {name: self.values[slot]
+                    for name, slot in self.scope.slots.items()
+                    if self.values[slot] is not unassigned}
+        if self.extras:
+            bindings.update(self.extras)
+        return bindings
+
+    def lookup(self, symbol):
+        """Return the value bound to SYMBOL.  Errors if SYMBOL is not found."""
+        slot = self.scope.slots.get(symbol)
+        if slot is not None and self.values[slot] is not unassigned:
+            return self.values[slot]
+        if self.extras and symbol in self.extras:
+            return self.extras[symbol]
+        return self.parent.lookup(symbol)
+
+    def define(self, sym, val):
+        """Define Scheme symbol SYM to have value VAL in SELF."""
+        slot = self.scope.slots.get(sym)
+        if slot is not None:
+            self.values[slot] = val
+        else:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[sym] = val
+
+    def __getstate__(self):
+        return self.parent, self.scope, self.values, self.extras, self.depth
+
+    def __setstate__(self, state):
+        self.parent, self.scope, self.values, self.extras, self.depth = state
+
+def call_scope(procedure):
+    """Return the Scope of the frames created by calls to the LambdaProcedure
+    or MuProcedure PROCEDURE, which is computed once and cached.  Its
+    num_formals is the number of arguments PROCEDURE takes, and its other
+    slots hold the names defined in the body, as in analyze_procedure."""
+    if procedure.scope is None:
+        if isinstance(procedure, MuProcedure):
+            parent = DYNAMIC
+        else:
+            parent = frame_scope(procedure.env)
+        defined = scan_defines(procedure.body, [])
+        procedure.scope = Scope(procedure.formals, defined, parent)
+    return procedure.scope
+
 class LambdaProcedure:
     """A procedure defined by a lambda expression or the complex define form."""
 
@@ -164,10 +275,19 @@ class LambdaProcedure:
         self.formals = formals
         self.body = body
         self.env = env
+        self.scope = None
+        self.analyzed = None
 
     def __str__(self):
         return "(lambda {0} {1})".format(str(self.formals), str(self.body))
 
+    def __getstate__(self):
+        # Pickle the definition, which is analyzed again where it is loaded
+        return self.formals, self.body, self.env
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
     def __repr__(self):
         args = (self.formals, self.body, self.env)
         return "LambdaProcedure({0}, {1}, {2})".format(*(repr(a) for a in args))
@@ -191,10 +311,18 @@ class MuProcedure:
         can be handled by using (begin (display x) (+ x 1)) as the body."""
         self.formals = formals
         self.body = body
+        self.scope = None
+        self.analyzed = None
 
     def __str__(self):
         return "(mu {0} {1})".format(str(self.formals), str(self.body))
 
+    def __getstate__(self):
+        return self.formals, self.body
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
     def __repr__(self):
         args = (self.formals, self.body)
         return "MuProcedure({0}, {1})".format(*(repr(a) for a in args))
@@ -207,29 +335,13 @@ class MuProcedure:
 def do_lambda_form(vals, env):
     """Evaluate a lambda form with parameters VALS in environment ENV.
         Checks if the length is larger than one, if so add begin in order to evulate all terms and return the last"""
-    check_form(vals, 2)
-    formals = vals[0]
-    check_formals(formals)
-
-    body = vals.second
-    if len(body) > 1:
-        body = Pair('begin', body)
-    else:
-        body = body.first
+    formals, body = lambda_parts(vals)
     return LambdaProcedure(formals, body, env)
 
 def do_mu_form(vals):
     """Evaluate a mu form with parameters VALS.
         Similarly to lambda. with the difference of dynamic scope (no need in passing environemnt) """
-    check_form(vals, 2)
-    formals = vals[0]
-    check_formals(formals)
-
-    body = vals.second
-    if len(body) > 1:
-        body = Pair('begin', body)
-    else:
-        body = body.first
+    formals, body = lambda_parts(vals)
     return MuProcedure(formals, body)
 
 
@@ -243,10 +355,7 @@ def do_define_form(vals, env):
         env.define(target, scheme_eval(vals.second.first, env))     #Define the symbol in the current frame
         return target                                               #and eval the rest of the expression.
     elif isinstance(target, Pair):
-        symbol = target.first
-        if not scheme_symbolp(symbol):
-            raise SchemeError("bad symbol name")
-        rest = Pair(target.second, vals.second)
+        symbol, rest = function_definition(vals)
         env.define(symbol, do_lambda_form(rest, env))
         return symbol
     else:
@@ -260,28 +369,26 @@ def do_quote_form(vals):
 
 
 
+def do_delay_form(vals, env, chained=False):
+    """Evaluate a delay form with parameters VALS in environment ENV, or a
+    delay-force form if CHAINED is true, returning an unforced Promise."""
+    check_form(vals, 1, 1)
+    expr = vals.first
+    return Promise(lambda: scheme_eval(expr, env), chained)
+
 def do_let_form(vals, env):
     """Evaluate a let form with parameters VALS in environment ENV."""
-    check_form(vals, 2)
-    bindings = vals[0]
-    exprs = vals.second
-    if not scheme_listp(bindings):
-        raise SchemeError("bad bindings list in let form")
+    names, value_exprs, exprs = let_parts(vals)
 
     # Add a frame containing bindings
-    names, values = nil, nil
-    
-    while bindings is not nil:
-        names = Pair(bindings[0][0], names)
-        values = Pair(scheme_eval(bindings[0][1], env), values)
-        bindings = bindings.second
-    new_env = env.make_call_frame(names, values)
+    values = [scheme_eval(expr, env) for expr in value_exprs]
+    new_env = env.make_call_frame(names, scheme_list(*values))
 
     # Evaluate all but the last expression after bindings, and return the last
-    last = len(exprs)-1
-    for i in range(0, last):
-        scheme_eval(exprs[i], new_env)
-    return exprs[last], new_env
+    while exprs.second is not nil:
+        scheme_eval(exprs.first, new_env)
+        exprs = exprs.second
+    return exprs.first, new_env
 
 
 #########################
@@ -327,7 +434,7 @@ def quote(value):
     >>> scheme_eval(s, Frame(None))  # "hello" is undefined in this frame.
     'hello'
     """
-    return Pair("quote", Pair(value, nil))
+    return Pair(QUOTE, Pair(value, nil))
 
 def do_or_form(vals, env):
     """Evaluate short-circuited or with parameters VALS in environment ENV.
@@ -351,7 +458,7 @@ def do_cond_form(vals, env):
     num_clauses = len(vals)
     for i, clause in enumerate(vals):
         check_form(clause, 1)
-        if clause.first == "else":
+        if clause.first is ELSE:
             if i < num_clauses-1:
                 raise SchemeError("else must be last")
             test = True
@@ -362,10 +469,7 @@ def do_cond_form(vals, env):
         if scheme_true(test):
             if len(clause) == 1:
                 return quote(test)
-            elif len(clause) == 2:
-                return clause.second.first
-            else:
-                return Pair('begin', clause.second)
+            return sequence(clause.second)
     return okay
 
 def do_begin_form(vals, env):
@@ -380,11 +484,11 @@ def do_begin_form(vals, env):
     return target
 
 LOGIC_FORMS = {
-        "and": do_and_form,
-        "or": do_or_form,
-        "if": do_if_form,
-        "cond": do_cond_form,
-        "begin": do_begin_form,
+        AND: do_and_form,
+        OR: do_or_form,
+        IF: do_if_form,
+        COND: do_cond_form,
+        BEGIN: do_begin_form,
         }
 
 # Utility methods for checking the structure of Scheme programs
@@ -407,19 +511,111 @@ def check_formals(formals):
     is not a well-formed list of symbols or if any symbol is repeated.
 
     >>> check_formals(read_line("(a b c)"))
-    """
 
-    repeated = []
-    while formals != nil:
-        if scheme_symbolp(formals.first):
-            if formals.first in repeated:
-                raise SchemeError("repeated terms")
-            repeated.append(formals.first)
-            formals = formals.second
-        else: 
+    The result is cached on FORMALS, so checking the same list again is free.
+    """
+    if isinstance(formals, Pair):
+        formals.cached(check_formals, check_symbols)
+    elif formals is not nil:
+        raise SchemeError("not a scheme symbol")
+
+def check_symbols(formals):
+    """Check that the Scheme list FORMALS contains only distinct symbols."""
+    seen = set()
+    while formals is not nil:
+        if not isinstance(formals, Pair) or not scheme_symbolp(formals.first):
             raise SchemeError("not a scheme symbol")
-
-
+        if formals.first in seen:
+            raise SchemeError("repeated terms")
+        seen.add(formals.first)
+        formals = formals.second
+
+def syntax_cached(fn):
+    """Decorate FN, which checks and desugars the operands VALS of a special
+    form, so that its result is cached on VALS and re-evaluating the same form
+    skips it."""
+    def checked(vals):
+        if isinstance(vals, Pair):
+            return vals.cached(fn, fn)
+        return fn(vals)
+    return checked
+
+@syntax_cached
+def sequence(exprs):
+    """Return a single expression that evaluates the non-empty Scheme list of
+    expressions EXPRS in order, wrapping several of them in begin."""
+    if exprs.second is nil:
+        return exprs.first
+    return Pair(BEGIN, exprs)
+
+@syntax_cached
+def lambda_parts(vals):
+    """Return the formals and the body of a lambda or mu form with operands
+    VALS, as a single expression."""
+    check_form(vals, 2)
+    check_formals(vals.first)
+    return vals.first, sequence(vals.second)
+
+@syntax_cached
+def function_definition(vals):
+    """Return the name and the lambda operands of a define form with operands
+    VALS that defines a procedure."""
+    target = vals.first
+    if not scheme_symbolp(target.first):
+        raise SchemeError("bad symbol name")
+    return target.first, Pair(target.second, vals.second)
+
+@syntax_cached
+def memoized_definition(vals):
+    """Return the operands of a define form equivalent to the define-memoized
+    form with operands VALS, which binds a name to a memoized procedure.
+
+    >>> print(memoized_definition(read_line("((f x) (* x x))")))
+    (f ((quote #[primitive]) (lambda (x) (* x x))))
+    """
+    check_form(vals, 2)
+    if not isinstance(vals.first, Pair):
+        raise SchemeError("define-memoized must define a procedure")
+    symbol, rest = function_definition(vals)
+    procedure = Pair(LAMBDA, rest)
+    memoized = Pair(Pair(QUOTE, Pair(MEMOIZE, nil)), Pair(procedure, nil))
+    return Pair(symbol, Pair(memoized, nil))
+
+@syntax_cached
+def stream_pair(vals):
+    """Return an expression equivalent to the cons-stream form with operands
+    VALS, which conses its first operand onto a promise of its second.
+
+    >>> print(stream_pair(read_line("(1 (f))")))
+    ((quote #[primitive]) 1 (delay (f)))
+    """
+    check_form(vals, 2, 2)
+    rest = Pair(Pair(DELAY, vals.second), nil)
+    return Pair(Pair(QUOTE, Pair(CONS, nil)), Pair(vals.first, rest))
+
+# The cons primitive, which cons-stream applies regardless of the bindings
+# in the environment of the form
+CONS = PrimitiveProcedure(scheme_cons)
+
+@syntax_cached
+def let_parts(vals):
+    """Return the names, the value expressions and the body of a let form with
+    operands VALS.  The names form a Scheme list and the values a tuple."""
+    check_form(vals, 2)
+    bindings = vals.first
+    if not scheme_listp(bindings):
+        raise SchemeError("bad bindings list in let form")
+    names, values = [], []
+    while bindings is not nil:
+        check_form(bindings.first, 2, 2)
+        names.append(bindings.first.first)
+        values.append(bindings.first.second.first)
+        bindings = bindings.second
+    formals = nil
+    for name in reversed(names):
+        formals = Pair(name, formals)
+    check_formals(formals)
+    return formals, tuple(values), vals.second
 
 ##################
 # Tail Recursion #
@@ -446,29 +642,42 @@ def scheme_optimized_eval(expr, env):
         if (scheme_symbolp(first) # first might be unhashable
             and first in LOGIC_FORMS):
             expr=LOGIC_FORMS[first](rest, env)   #changing expr in the current environment to follow tail recursion
-        elif first == "lambda":
+        elif first is LAMBDA:
             return do_lambda_form(rest, env)
-        elif first == "mu":
+        elif first is MU:
             return do_mu_form(rest)
-        elif first == "define":
+        elif first is DEFINE:
             return do_define_form(rest, env)
-        elif first == "quote":
+        elif first is DEFINE_MEMOIZED:
+            return do_define_form(memoized_definition(rest), env)
+        elif first is QUOTE:
             return do_quote_form(rest)
-        elif first == "let":                     #changing expr and env in the current environment to follow tail recursion
+        elif first is DELAY or first is DELAY_FORCE:
+            return do_delay_form(rest, env, first is DELAY_FORCE)
+        elif first is CONS_STREAM:
+            expr = stream_pair(rest)
+        elif first is LET:                       #changing expr and env in the current environment to follow tail recursion
             expr, env = do_let_form(rest, env)
         else:
+            stats.steps += 1
             procedure = scheme_optimized_eval(first, env)  # Changing scheme_apply to be part of scheme_eval_optimized, that way we can preform everything 
-            args = rest.map(lambda operand: scheme_optimized_eval(operand, env)) # in one frame
+            args = []                                      # in one frame
+            while rest is not nil:
+                args.append(scheme_optimized_eval(rest.first, env))
+                rest = rest.second
 
             if isinstance(procedure, PrimitiveProcedure):
-                return apply_primitive(procedure, args, env) # returning the primitive values into the current environment
+                return procedure.apply(args, env) # returning the primitive values into the current environment
         
             elif isinstance(procedure, LambdaProcedure):
-                new_env=procedure.env.make_call_frame(procedure.formals,args)
+                new_env = bind_arguments(procedure.env, call_scope(procedure),
+                                         args)
                 expr,env = procedure.body,new_env
+                stats.applications += 1
             elif isinstance(procedure, MuProcedure):
-                new_env = env.make_call_frame(procedure.formals, args)
+                new_env = bind_arguments(env, call_scope(procedure), args)
                 expr, env = procedure.body, new_env
+                stats.applications += 1
             else:
                 raise SchemeError("Cannot call {0}".format(str(procedure)))
 
@@ -478,21 +687,587 @@ def scheme_optimized_eval(expr, env):
 scheme_eval = scheme_optimized_eval
 
 
+############
+# Analysis #
+############
+
+# The evaluators above re-inspect the structure of an expression each time it
+# is evaluated. The analyzer below inspects each expression once, producing an
+# executor: a Python function of one argument, an environment, that performs
+# only the work needed to evaluate that particular expression.
+#
+# While analyzing, the analyzer tracks the Scope of each expression, which
+# describes the frames it will be evaluated in. A symbol bound in a local
+# frame is resolved to a lexical address, the number of frames to walk up and
+# the slot in the values of that frame, so that looking it up does not search
+# the environment by name.
+
+# The parent of a Scope whose enclosing frames are not known until evaluation
+DYNAMIC = object()
+
+class Scope:
+    """The names of a CallFrame, numbered by slot: first the symbols in the
+    Scheme list FORMALS, then the names in the Python list DEFINED that are
+    not formals. PARENT is the Scope of the enclosing frame, None if it is
+    the global frame, or DYNAMIC if it is unknown.
+
+    >>> scope = Scope(read_line("(a b)"), ['c', 'a'], None)
+    >>> scope.slots['a'], scope.slots['c'], scope.num_formals, scope.size
+    (0, 2, 2, 3)
+    """
+
+    def __init__(self, formals, defined, parent):
+        self.slots = {}
+        while formals is not nil:
+            self.slots[formals.first] = len(self.slots)
+            formals = formals.second
+        self.num_formals = len(self.slots)
+        for name in defined:
+            self.slots.setdefault(name, len(self.slots))
+        self.size = len(self.slots)
+        self.parent = parent
+
+def frame_scope(env):
+    """Return the Scope describing the frames of environment ENV."""
+    if isinstance(env, CallFrame):
+        return env.scope
+    elif env.parent is None:
+        return None
+    else:
+        return DYNAMIC
+
+def resolve(symbol, scope):
+    """Return the lexical address (depth, slot) of SYMBOL in SCOPE. The slot
+    is None if SYMBOL is global, and both are None if SYMBOL must be looked
+    up by name because an enclosing scope is DYNAMIC.
+
+    >>> scope = Scope(read_line("(x)"), [], Scope(read_line("(y z)"), [], None))
+    >>> resolve('z', scope), resolve('x', scope), resolve('car', scope)
+    ((1, 1), (0, 0), (2, None))
+    """
+    depth = 0
+    while scope is not None:
+        if scope is DYNAMIC:
+            return None, None
+        if symbol in scope.slots:
+            return depth, scope.slots[symbol]
+        scope = scope.parent
+        depth += 1
+    return depth, None
+
+def scan_defines(expr, names):
+    """Append to the Python list NAMES the symbols that evaluating EXPR may
+    define in the frame it is evaluated in, and return NAMES. The bodies of
+    nested procedures and let forms are not scanned."""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return names
+    first, rest = expr.first, expr.second
+    if first is QUOTE or first is LAMBDA or first is MU:
+        return names
+    elif (first is DEFINE or first is DEFINE_MEMOIZED) and rest is not nil:
+        target = rest.first
+        if isinstance(target, Pair):
+            if scheme_symbolp(target.first):
+                names.append(target.first)
+            return names
+        elif scheme_symbolp(target):
+            names.append(target)
+    elif first is LET and rest is not nil:
+        bindings = rest.first
+        while isinstance(bindings, Pair):
+            scan_defines(bindings.first, names)
+            bindings = bindings.second
+        return names
+    while rest is not nil:
+        scan_defines(rest.first, names)
+        rest = rest.second
+    return names
+
+def scheme_analyze(expr, scope=None, tail=False):
+    """Return an executor for Scheme expression EXPR, which will be evaluated
+    in frames described by SCOPE. If TAIL is true, EXPR is in tail position
+    and calls to compound procedures return a TailCall rather than being
+    applied.
+
+    >>> execute = scheme_analyze(read_line("(+ 2 (* 3 4))"))
+    >>> execute(create_global_frame())
+    14
+    """
+    try:
+        return analyze_expression(expr, scope, tail)
+    except SchemeError as err:
+        # Malformed expressions are only reported if they are evaluated
+        error = err
+        def execute(env):
+            raise error.with_traceback(None)
+        return execute
+
+def analyze_expression(expr, scope, tail):
+    """Return an executor for EXPR, raising a SchemeError if it is malformed."""
+    if expr is None:
+        raise SchemeError("Cannot evaluate an undefined expression.")
+
+    # Analyze Atoms
+    if scheme_symbolp(expr):
+        return analyze_symbol(expr, scope)
+    elif scheme_atomp(expr) or scheme_stringp(expr) or expr is okay:
+        return lambda env: expr
+
+    # All non-atomic expressions are lists.
+    if not scheme_listp(expr):
+        raise SchemeError("malformed list: {0}".format(str(expr)))
+    first, rest = expr.first, expr.second
+
+    # Analyze Combinations
+    if scheme_symbolp(first) and first in ANALYZERS:
+        return ANALYZERS[first](rest, scope, tail)
+    return analyze_combination(first, rest, scope, tail)
+
+def analyze_symbol(symbol, scope):
+    """Return an executor that looks up SYMBOL by its lexical address."""
+    depth, slot = resolve(symbol, scope)
+    if depth is None:
+        return lambda env: env.lookup(symbol)
+    elif slot is None:
+        def execute(env):
+            frame = env
+            for _ in range(depth):
+                # Names outside a Scope, such as those defined by eval
+                if frame.extras and symbol in frame.extras:
+                    return frame.extras[symbol]
+                frame = frame.parent
+            try:
+                return frame.bindings[symbol]
+            except KeyError:
+                return env.lookup(symbol)
+        return execute
+    for _ in range(depth):
+        scope = scope.parent
+    if slot < scope.num_formals:
+        # Formal parameters are always assigned
+        if depth == 0:
+            return lambda env: env.values[slot]
+        elif depth == 1:
+            return lambda env: env.parent.values[slot]
+    def execute(env):
+        frame = env
+        for _ in range(depth):
+            frame = frame.parent
+        value = frame.values[slot]
+        if value is unassigned:
+            return frame.parent.lookup(symbol)
+        return value
+    return execute
+
+def analyze_combination(operator, operands, scope, tail):
+    """Return an executor for the call of OPERATOR on OPERANDS.  Calls of
+    primitives with one or two operands pass the values straight to the
+    Python function when its arity allows."""
+    operator = scheme_analyze(operator, scope)
+    operands = [scheme_analyze(operand, scope) for operand in operands]
+    # Compound procedures in tail position return to the loop in analyzed_apply
+    call = TailCall if tail else analyzed_apply
+    if len(operands) == 1:
+        operand, = operands
+        def execute(env):
+            stats.steps += 1
+            procedure = operator(env)
+            arg = operand(env)
+            if type(procedure) is PrimitiveProcedure:
+                if 1 in procedure.direct_arity:
+                    return procedure.fn(arg)
+                return procedure.apply([arg], env)
+            return call(procedure, [arg], env)
+    elif len(operands) == 2:
+        left, right = operands
+        def execute(env):
+            stats.steps += 1
+            procedure = operator(env)
+            arg0, arg1 = left(env), right(env)
+            if type(procedure) is PrimitiveProcedure:
+                if 2 in procedure.direct_arity:
+                    return procedure.fn(arg0, arg1)
+                return procedure.apply([arg0, arg1], env)
+            return call(procedure, [arg0, arg1], env)
+    else:
+        def execute(env):
+            stats.steps += 1
+            procedure = operator(env)
+            args = [operand(env) for operand in operands]
+            if type(procedure) is PrimitiveProcedure:
+                return procedure.apply(args, env)
+            return call(procedure, args, env)
+    return execute
+
+def analyze_body(exprs, scope, tail):
+    """Return an executor for the non-empty Scheme list of expressions EXPRS,
+    which evaluates each in order and returns the value of the last."""
+    leading, last = analyze_operands(exprs, scope, tail)
+    if not leading:
+        return last
+    def execute(env):
+        for executor in leading:
+            executor(env)
+        return last(env)
+    return execute
+
+def analyze_procedure(procedure, parent):
+    """Analyze the body of the LambdaProcedure or MuProcedure PROCEDURE, whose
+    frames have the Scope PARENT as their parent."""
+    defined = scan_defines(procedure.body, [])
+    procedure.scope = Scope(procedure.formals, defined, parent)
+    procedure.analyzed = scheme_analyze(procedure.body, procedure.scope, True)
+
+class TailCall:
+    """A call of PROCEDURE on the Python list ARGS from environment ENV, which
+    is returned from a tail position so that it is applied by the loop in
+    analyzed_apply rather than on top of the Python stack."""
+
+    def __init__(self, procedure, args, env):
+        self.procedure = procedure
+        self.args = args
+        self.env = env
+
+def analyzed_apply(procedure, args, env):
+    """Apply PROCEDURE to the Python list ARGS in environment ENV, performing
+    any tail calls returned by the body of PROCEDURE in a loop."""
+    while True:
+        if isinstance(procedure, PrimitiveProcedure):
+            return procedure.apply(args, env)
+        elif isinstance(procedure, LambdaProcedure):
+            if procedure.analyzed is None:
+                analyze_procedure(procedure, frame_scope(procedure.env))
+            env = bind_arguments(procedure.env, procedure.scope, args)
+        elif isinstance(procedure, MuProcedure):
+            if procedure.analyzed is None:
+                analyze_procedure(procedure, DYNAMIC)
+            env = bind_arguments(env, procedure.scope, args)
+        else:
+            raise SchemeError("Cannot call {0}".format(str(procedure)))
+        stats.applications += 1
+        result = procedure.analyzed(env)
+        if not isinstance(result, TailCall):
+            return result
+        stats.tail_calls += 1
+        procedure, args, env = result.procedure, result.args, result.env
+
+def bind_arguments(parent, scope, args):
+    """Return a new CallFrame for SCOPE whose parent is PARENT, in which the
+    formal parameters of SCOPE are bound to the values in the Python list
+    ARGS. ARGS becomes the values of the new frame."""
+    if len(args) < scope.num_formals:
+        raise SchemeError("Not enough values")
+    if len(args) > scope.num_formals:
+        raise SchemeError("Not enough symbols")
+    if scope.size > scope.num_formals:
+        args.extend([unassigned] * (scope.size - scope.num_formals))
+    return CallFrame(parent, scope, args)
+
+def scheme_analyzed_eval(expr, env):
+    """Evaluate Scheme expression EXPR in environment ENV by analyzing it and
+    then running the resulting executor.
+
+    >>> expr = read_line("((lambda (x) (* x x)) 12)")
+    >>> scheme_analyzed_eval(expr, create_global_frame())
+    144
+    """
+    return scheme_analyze(expr, frame_scope(env))(env)
+
+##################
+# Analyzed Forms #
+##################
+
+def analyze_lambda_form(vals, scope, tail):
+    """Analyze a lambda form with parameters VALS."""
+    formals, body = lambda_parts(vals)
+    template = LambdaProcedure(formals, body, None)
+    analyze_procedure(template, scope)
+    body_scope, analyzed = template.scope, template.analyzed
+    def execute(env):
+        procedure = LambdaProcedure(formals, body, env)
+        procedure.scope, procedure.analyzed = body_scope, analyzed
+        return procedure
+    return execute
+
+def analyze_mu_form(vals, scope, tail):
+    """Analyze a mu form with parameters VALS."""
+    formals, body = lambda_parts(vals)
+    procedure = MuProcedure(formals, body)
+    analyze_procedure(procedure, DYNAMIC)
+    return lambda env: procedure
+
+def analyze_define_form(vals, scope, tail):
+    """Analyze a define form with parameters VALS."""
+    check_form(vals, 2)
+    target = vals[0]
+    if scheme_symbolp(target):
+        check_form(vals, 2, 2)
+        value = scheme_analyze(vals.second.first, scope)
+    elif isinstance(target, Pair):
+        target, rest = function_definition(vals)
+        value = analyze_lambda_form(rest, scope, False)
+    else:
+        raise SchemeError("cannot define argument")
+    if scope is not None and scope is not DYNAMIC and target in scope.slots:
+        slot = scope.slots[target]
+        def execute(env):
+            env.values[slot] = value(env)
+            return target
+    else:
+        def execute(env):
+            env.define(target, value(env))
+            return target
+    return execute
+
+def analyze_define_memoized_form(vals, scope, tail):
+    """Analyze a define-memoized form with parameters VALS."""
+    return analyze_define_form(memoized_definition(vals), scope, tail)
+
+def analyze_delay_form(vals, scope, tail, chained=False):
+    """Analyze a delay form with parameters VALS."""
+    check_form(vals, 1, 1)
+    value = scheme_analyze(vals.first, scope)
+    return lambda env: Promise(lambda: value(env), chained)
+
+def analyze_delay_force_form(vals, scope, tail):
+    """Analyze a delay-force form with parameters VALS."""
+    return analyze_delay_form(vals, scope, tail, True)
+
+def analyze_cons_stream_form(vals, scope, tail):
+    """Analyze a cons-stream form with parameters VALS."""
+    return scheme_analyze(stream_pair(vals), scope, tail)
+
+def analyze_quote_form(vals, scope, tail):
+    """Analyze a quote form with parameters VALS."""
+    check_form(vals, 1, 1)
+    quoted = vals.first
+    return lambda env: quoted
+
+def analyze_let_form(vals, scope, tail):
+    """Analyze a let form with parameters VALS."""
+    formals, value_exprs, body = let_parts(vals)
+    values = [scheme_analyze(expr, scope) for expr in value_exprs]
+    let_scope = Scope(formals, scan_defines(sequence(body), []), scope)
+    body = analyze_body(body, let_scope, tail)
+    padding = [unassigned] * (let_scope.size - let_scope.num_formals)
+    def execute(env):
+        args = [value(env) for value in values]
+        args.extend(padding)
+        return body(CallFrame(env, let_scope, args))
+    return execute
+
+def analyze_if_form(vals, scope, tail):
+    """Analyze an if form with parameters VALS."""
+    check_form(vals, 2, 3)
+    predicate = scheme_analyze(vals.first, scope)
+    consequent = scheme_analyze(vals.second.first, scope, tail)
+    if vals.second.second is nil:
+        alternative = lambda env: okay
+    else:
+        alternative = scheme_analyze(vals.second.second.first, scope, tail)
+    def execute(env):
+        if predicate(env) is not False:
+            return consequent(env)
+        return alternative(env)
+    return execute
+
+def analyze_and_form(vals, scope, tail):
+    """Analyze a short-circuited and form with parameters VALS."""
+    if vals is nil:
+        return lambda env: True
+    leading, last = analyze_operands(vals, scope, tail)
+    def execute(env):
+        for executor in leading:
+            if executor(env) is False:
+                return False
+        return last(env)
+    return execute
+
+def analyze_or_form(vals, scope, tail):
+    """Analyze a short-circuited or form with parameters VALS."""
+    if vals is nil:
+        return lambda env: False
+    leading, last = analyze_operands(vals, scope, tail)
+    def execute(env):
+        for executor in leading:
+            value = executor(env)
+            if value is not False:
+                return value
+        return last(env)
+    return execute
+
+def analyze_operands(vals, scope, tail):
+    """Return a list of executors for all but the last expression in the
+    Scheme list VALS, and an executor for the last (which inherits TAIL)."""
+    executors = []
+    while vals.second is not nil:
+        executors.append(scheme_analyze(vals.first, scope))
+        vals = vals.second
+    return executors, scheme_analyze(vals.first, scope, tail)
+
+def analyze_cond_form(vals, scope, tail):
+    """Analyze a cond form with parameters VALS. A malformed clause is only
+    reported if it is reached."""
+    clauses = []
+    num_clauses = len(vals)
+    for i, clause in enumerate(vals):
+        try:
+            clauses.append(analyze_cond_clause(clause, i == num_clauses-1,
+                                               scope, tail))
+        except SchemeError as err:
+            error = err
+            def test(env, error=error):
+                raise error.with_traceback(None)
+            clauses.append((test, None))
+    def execute(env):
+        for test, body in clauses:
+            value = test(env)
+            if value is not False:
+                if body is None:
+                    return value
+                return body(env)
+        return okay
+    return execute
+
+def analyze_cond_clause(clause, last, scope, tail):
+    """Return a test executor and a body executor (or None) for CLAUSE,
+    which is the LAST clause of its cond form if LAST is true."""
+    check_form(clause, 1)
+    if clause.first is ELSE:
+        if not last:
+            raise SchemeError("else must be last")
+        elif clause.second is nil:
+            raise SchemeError("badly formed else clause")
+        test = lambda env: True
+    else:
+        test = scheme_analyze(clause.first, scope)
+    if clause.second is nil:
+        return test, None
+    return test, analyze_body(clause.second, scope, tail)
+
+def analyze_begin_form(vals, scope, tail):
+    """Analyze a begin form with parameters VALS."""
+    check_form(vals, 1)
+    return analyze_body(vals, scope, tail)
+
+ANALYZERS = {
+        AND: analyze_and_form,
+        BEGIN: analyze_begin_form,
+        COND: analyze_cond_form,
+        CONS_STREAM: analyze_cons_stream_form,
+        DEFINE: analyze_define_form,
+        DEFINE_MEMOIZED: analyze_define_memoized_form,
+        DELAY: analyze_delay_form,
+        DELAY_FORCE: analyze_delay_force_form,
+        IF: analyze_if_form,
+        LAMBDA: analyze_lambda_form,
+        LET: analyze_let_form,
+        MU: analyze_mu_form,
+        OR: analyze_or_form,
+        QUOTE: analyze_quote_form,
+        }
+
+##########################################################
+# Evaluate by analysis, keeping the evaluators above for #
+# comparison (assign them to scheme_eval to use them)    #
+##########################################################
+scheme_eval = scheme_analyzed_eval
+
+###############
+# Memoization #
+###############
+
+class Memo:
+    """The values of calls of a Scheme procedure, keyed by their arguments.
+
+    A Memo is the function of a primitive procedure that applies PROCEDURE
+    the first time it is called with some arguments, and afterwards returns
+    the same value.  Arguments are compared with equal?, so calls with equal
+    lists share a value.  At most CAPACITY values are kept (any number if
+    CAPACITY is None), evicting the least recently used value when full.
+    Calls with unhashable arguments are applied without caching.
+    """
+
+    def __init__(self, procedure, capacity=None):
+        self.procedure = procedure
+        self.capacity = capacity
+        self.values = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, *args):
+        args, env = list(args[:-1]), args[-1]
+        key = tuple(map(equal_key, args))
+        try:
+            value = self.values[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return analyzed_apply(self.procedure, args, env)
+        else:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return value
+        self.misses += 1
+        value = analyzed_apply(self.procedure, args, env)
+        self.values[key] = value
+        if self.capacity is not None and len(self.values) > self.capacity:
+            self.values.popitem(last=False)
+        return value
+
+def scheme_memoize(procedure, capacity=None):
+    """Return a procedure that applies PROCEDURE, remembering the values of
+    the last CAPACITY distinct calls, or of all calls if CAPACITY is omitted.
+
+    >>> env = create_global_frame()
+    >>> expr = read_line("(memoize (lambda (x) (* x x)) 2)")
+    >>> square = scheme_eval(expr, env)
+    >>> [square.apply([x], env) for x in (3, 4, 3, 5, 4)]
+    [9, 16, 9, 25, 16]
+    >>> square.fn.hits, square.fn.misses, len(square.fn.values)
+    (1, 4, 2)
+    """
+    if not isinstance(procedure, (PrimitiveProcedure, LambdaProcedure,
+                                  MuProcedure)):
+        raise SchemeError("Cannot memoize {0}".format(str(procedure)))
+    if capacity is not None and (not isinstance(capacity, int) or
+                                 scheme_booleanp(capacity) or capacity < 1):
+        raise SchemeError("memoize capacity must be a positive integer")
+    return PrimitiveProcedure(Memo(procedure, capacity), True)
+
+MEMOIZE = PrimitiveProcedure(scheme_memoize)
+
+def memo_stats(procedure):
+    """Return an association list of the hits, misses, size and capacity of
+    the memoized PROCEDURE, with capacity #f if it is unbounded."""
+    memo = getattr(procedure, "fn", None)
+    if not isinstance(memo, Memo):
+        raise SchemeError("{0} is not memoized".format(str(procedure)))
+    capacity = False if memo.capacity is None else memo.capacity
+    return scheme_list(*(Pair(Symbol(name), value) for name, value in [
+        ("hits", memo.hits), ("misses", memo.misses),
+        ("size", len(memo.values)), ("capacity", capacity)]))
+
+
 ################
 # Input/Output #
 ################
 
 def read_eval_print_loop(next_line, env, quiet=False, startup=False,
-                         interactive=False, load_files=()):
-    """Read and evaluate input until an end of file or keyboard interrupt."""
+                         interactive=False, load_files=(), read=scheme_read,
+                         nested=False):
+    """Read and evaluate input until an end of file or keyboard interrupt.
+    Each expression is read from a Buffer returned by NEXT_LINE with READ.
+    NESTED is true for the loop that loads a file, which passes a circular
+    require on to the loop that loaded it."""
     if startup:
         for filename in load_files:
-            scheme_load(filename, True, env)
+            scheme_load(Symbol(filename), True, env)
     while True:
         try:
             src = next_line()
             while src.more_on_line:
-                expression = scheme_read(src)
+                expression = read(src)
                 result = scheme_eval(expression, env)
                 if not quiet and result is not None:
                     print(result)
@@ -500,6 +1275,8 @@ def read_eval_print_loop(next_line, env, quiet=False, startup=False,
             if (isinstance(err, RuntimeError) and
                 'maximum recursion depth exceeded' not in err.args[0]):
                 raise
+            if isinstance(err, RequireCycleError) and nested:
+                raise  # Abort every file in the cycle
             print("Error:", err)
         except KeyboardInterrupt:  # <Control>-C
             if not startup:
@@ -514,23 +1291,222 @@ def read_eval_print_loop(next_line, env, quiet=False, startup=False,
 def scheme_load(*args):
     """Load a Scheme source file. ARGS should be of the form (SYM, ENV) or (SYM,
     QUIET, ENV). The file named SYM is loaded in environment ENV, with verbosity
-    determined by QUIET (default true)."""
+    determined by QUIET (default true).  A quiet load reads the expressions of
+    an unchanged file from its cache (see cached_groups)."""
     if not (2 <= len(args) <= 3):
         vals = args[:-1]
         raise SchemeError("wrong number of arguments to load: {0}".format(vals))
     sym = args[0]
     quiet = args[1] if len(args) > 2 else True
     env = args[-1]
+    with scheme_open(file_symbol(sym, "load")) as infile:
+        load_file(infile, quiet, env.global_frame())
+    return okay
+
+def file_symbol(sym, name):
+    """Return the file name symbol for SYM, a symbol or string argument to the
+    primitive NAME."""
     if (scheme_stringp(sym)):
-        sym = eval(sym)
-    check_type(sym, scheme_symbolp, 0, "load")
-    with scheme_open(sym) as infile:
-        lines = infile.readlines()
-    args = (lines, None) if quiet else (lines,)
+        sym = Symbol(eval(sym))
+    check_type(sym, scheme_symbolp, 0, name)
+    return sym
+
+def load_file(infile, quiet, env):
+    """Evaluate the expressions in the open source file INFILE in ENV."""
+    groups = cached_groups(infile) if quiet else None
+    if groups is not None:
+        lines = expression_lines(groups)
+        def next_line():
+            return Buffer(lines)
+        read_eval_print_loop(next_line, env, quiet=quiet, read=Buffer.pop,
+                             nested=True)
+        return
+    infile.seek(0)
+    args = (infile, None) if quiet else (infile,)
     def next_line():
         return buffer_lines(*args)
-    read_eval_print_loop(next_line, env.global_frame(), quiet=quiet)
-    return okay
+    read_eval_print_loop(next_line, env, quiet=quiet, nested=True)
+
+class RequireCycleError(SchemeError):
+    """A require of a file that is still being loaded.  It aborts the loads
+    of all the files in the cycle, rather than being reported by the loop
+    that evaluates each of them."""
+
+class LoadRegistry:
+    """A LoadRegistry records the files that require has loaded into one global
+    environment, so that each file is loaded there at most once.
+
+    Its files map the path of each file, in the order that they began to load,
+    to a list of the paths of the files it required and the seconds taken to
+    load it, including the files it required.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.loading = []  # The paths of the files being loaded, innermost last
+
+    def require(self, sym, env):
+        """Load the file named SYM into the global environment of ENV, unless
+        it has already been loaded there.
+
+        >>> import tempfile
+        >>> folder = tempfile.mkdtemp()
+        >>> a, b = (os.path.join(folder, name + ".scm") for name in "ab")
+        >>> for path, other in [(a, b), (b, a)]:
+        ...     with open(path, "w") as f:
+        ...         print('(require "{0}") (define done #t)'.format(other),
+        ...               file=f)
+        >>> env = create_global_frame()
+        >>> try:
+        ...     scheme_eval(read_line('(require "{0}")'.format(a)), env)
+        ... except RequireCycleError as err:
+        ...     print("aborted")
+        aborted
+        >>> "done" in env.bindings, scheme_eval(read_line("(load-graph)"), env)
+        (False, nil)
+        """
+        with scheme_open(file_symbol(sym, "require")) as infile:
+            path = os.path.realpath(infile.name)
+            if self.loading:
+                required = self.files[self.loading[-1]][0]
+                if path not in required:
+                    required.append(path)
+            if path in self.loading:
+                cycle = self.loading[self.loading.index(path):] + [path]
+                raise RequireCycleError("circular require: " +
+                                        " -> ".join(cycle))
+            if path in self.files:
+                return okay
+            self.files[path] = record = [[], None]
+            self.loading.append(path)
+            start = time.perf_counter()
+            try:
+                load_file(infile, True, env.global_frame())
+            except BaseException:
+                del self.files[path]
+                raise
+            finally:
+                self.loading.pop()
+                record[1] = time.perf_counter() - start
+        return okay
+
+    def graph(self):
+        """Return a Scheme list with an element (path seconds required ...)
+        for each file loaded, where each path is a string."""
+        def path_string(path):
+            escaped = path.replace('\\', '\\\\').replace('"', '\\"')
+            return String('"' + escaped + '"')
+        return scheme_list(*(
+            Pair(path_string(path),
+                 Pair(seconds, scheme_list(*map(path_string, required))))
+            for path, (required, seconds) in self.files.items()))
+
+# The parsed expressions of a loaded file are cached next to it, in a file
+# whose name adds CACHE_SUFFIX to the source file name.  The cache records the
+# modification time, size and hash of the source that it was read from.
+CACHE_SUFFIX = 'c'
+CACHE_VERSION = 1
+
+# The only globals that a cache may refer to: the constructors of the values
+# that the reader returns
+CACHE_GLOBALS = {('scheme_reader', 'pairs'), ('scheme_reader', 'nil'),
+                 ('scheme_tokens', 'Symbol'), ('scheme_tokens', 'String')}
+
+class CacheUnpickler(pickle.Unpickler):
+    """An Unpickler for cache files that refuses any global outside
+    CACHE_GLOBALS, so that a cache written by anyone who can write to the
+    directory of a source file cannot run code when the file is loaded.
+
+    >>> import io
+    >>> data = pickle.dumps(read_line("(f 'x 1.5)"))
+    >>> CacheUnpickler(io.BytesIO(data)).load()
+    Pair('f', Pair(Pair('quote', Pair('x', nil)), Pair(1.5, nil)))
+    >>> CacheUnpickler(io.BytesIO(pickle.dumps(print))).load()
+    Traceback (most recent call last):
+        ...
+    _pickle.UnpicklingError: cache may not refer to builtins.print
+    """
+
+    def find_class(self, module, name):
+        if (module, name) not in CACHE_GLOBALS:
+            raise pickle.UnpicklingError("cache may not refer to {0}.{1}"
+                                         .format(module, name))
+        return super().find_class(module, name)
+
+def read_cache(f):
+    """Read the next value from the open cache file F."""
+    return CacheUnpickler(f).load()
+
+def cached_groups(infile):
+    """Return the expressions in the open source file INFILE, in the groups
+    returned by read_groups, from its cache if that is up to date.  Return
+    None if the source cannot be read without errors."""
+    path = infile.name + CACHE_SUFFIX
+    stat = os.fstat(infile.fileno())
+    key = None
+    try:
+        with open(path, 'rb') as f:
+            key = read_cache(f)
+            if type(key) is not tuple or len(key) != 4:
+                key = None
+            elif key[:3] == (CACHE_VERSION, stat.st_mtime_ns, stat.st_size):
+                return read_cache(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.PickleError):
+        pass
+    text = infile.read()
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    new_key = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size, digest)
+    if key is not None and key[0] == CACHE_VERSION and key[3] == digest:
+        try:
+            with open(path, 'rb') as f:
+                read_cache(f)
+                groups = read_cache(f)
+            write_cache(path, new_key, groups)
+            return groups
+        except (OSError, EOFError, ValueError, TypeError, pickle.PickleError):
+            pass
+    try:
+        groups = read_groups(text.splitlines())
+    except (SyntaxError, ValueError):
+        return None
+    write_cache(path, new_key, groups)
+    return groups
+
+def write_cache(path, key, groups):
+    """Write KEY and GROUPS to the cache file at PATH, if possible.  The file
+    is replaced in one step, so that concurrent loads never see part of it."""
+    temp = '{0}.{1}'.format(path, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            pickle.dump(key, f)
+            pickle.dump(groups, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+    except (OSError, RecursionError, pickle.PickleError):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def read_groups(lines):
+    """Return the expressions read from LINES, grouped as read_eval_print_loop
+    reads them from successive Buffers: an error skips the rest of its group.
+
+    >>> read_groups(["(+ 1", "2) 3", "4"])
+    [[Pair('+', Pair(1, Pair(2, nil))), 3], [4]]
+    """
+    source = tokenize_lines(lines)
+    groups = []
+    while True:
+        src = Buffer(source)
+        if src.current() is None:
+            return groups
+        group = []
+        while src.more_on_line:
+            group.append(scheme_read(src))
+        groups.append(group)
+
+def expression_lines(groups):
+    """Yield each of GROUPS, then signal the end of the input."""
+    yield from groups
+    raise EOFError
 
 def scheme_open(filename):
     """If either FILENAME or FILENAME.scm is the name of a valid file,
@@ -551,14 +1527,84 @@ def create_global_frame():
     env.define("eval", PrimitiveProcedure(scheme_eval, True))
     env.define("apply", PrimitiveProcedure(scheme_apply, True))
     env.define("load", PrimitiveProcedure(scheme_load, True))
+    registry = LoadRegistry()
+    env.define("require", PrimitiveProcedure(registry.require, True))
+    env.define("load-graph", PrimitiveProcedure(registry.graph))
+    env.define("memoize", MEMOIZE)
+    env.define("memo-stats", PrimitiveProcedure(memo_stats))
+    env.define("parallel-map", PrimitiveProcedure(scheme_parallel_map, True))
     add_primitives(env)
     return env
 
+def scheme_parallel_map(procedure, s, *options):
+    """Apply PROCEDURE to the elements of S in worker processes, with OPTIONS
+    as described by scheme_parallel.parallel_map."""
+    import scheme_parallel
+    return scheme_parallel.parallel_map(procedure, s, *options)
+
+def select_backend(flag):
+    """Evaluate with the backend selected by the command-line FLAG."""
+    global scheme_eval
+    if flag == '-analyze':
+        scheme_eval = scheme_analyzed_eval
+    elif flag == '-tree':
+        scheme_eval = scheme_optimized_eval
+    elif flag == '-vm':
+        import scheme_vm
+        scheme_eval = scheme_vm.scheme_vm_eval
+    elif flag == '-cek':
+        import scheme_cek
+        scheme_eval = scheme_cek.scheme_cek_eval
+
+BACKEND_FLAGS = ('-analyze', '-tree', '-vm', '-cek')
+
+def start_profile(prefix, env):
+    """Profile the procedures applied from now on, which must be evaluated
+    by analysis, and write a report to PREFIX.profile and collapsed stacks to
+    PREFIX.folded when Python exits.  The report names each procedure by a
+    name bound to it in the global environment ENV, if any."""
+    global analyze_procedure
+    if scheme_eval is not scheme_analyzed_eval:
+        raise SchemeError("-profile requires the -analyze backend")
+    import atexit
+    import scheme_profile
+    profiler = scheme_profile.Profiler()
+    analyze_procedure = profiler.wrap(analyze_procedure, procedure_label)
+    def write():
+        names = {value.analyzed: name for name, value in env.bindings.items()
+                 if isinstance(value, (LambdaProcedure, MuProcedure))}
+        profiler.write(prefix, names)
+    atexit.register(write)
+
+def start_fold(dump=False):
+    """Fold constants in each expression before it is evaluated, as described
+    by scheme_fold, printing each folded expression to standard error if DUMP
+    is true."""
+    global scheme_eval
+    import scheme_fold
+    scheme_eval = scheme_fold.folding(scheme_eval, dump)
+
+def procedure_label(procedure):
+    """A label for an anonymous PROCEDURE, such as (lambda (x y))."""
+    form = 'lambda' if isinstance(procedure, LambdaProcedure) else 'mu'
+    return "({0} {1})".format(form, str(procedure.formals))
+
 @main
 def run(*argv):
     next_line = buffer_input
     interactive = True
     load_files = ()
+    profile = False
+    fold = None
+    while argv and (argv[0] in BACKEND_FLAGS or
+                    argv[0] in ('-profile', '-fold', '-fold-dump')):
+        if argv[0] == '-profile':
+            profile = True
+        elif argv[0] in ('-fold', '-fold-dump'):
+            fold = argv[0] == '-fold-dump'
+        else:
+            select_backend(argv[0])
+        argv = argv[1:]
     if argv:
         try:
             filename = argv[0]
@@ -566,13 +1612,21 @@ def run(*argv):
                 load_files = argv[1:]
             else:
                 input_file = open(argv[0])
-                lines = input_file.readlines()
                 def next_line():
-                    return buffer_lines(lines)
+                    return buffer_lines(input_file)
                 interactive = False
         except IOError as err:
             print(err)
             sys.exit(1)
-    read_eval_print_loop(next_line, create_global_frame(), startup=True,
+    env = create_global_frame()
+    if profile:
+        try:
+            start_profile(argv[0] if not interactive else 'scheme', env)
+        except SchemeError as err:
+            print("Error:", err, file=sys.stderr)
+            sys.exit(1)
+    if fold is not None:
+        start_fold(fold)
+    read_eval_print_loop(next_line, env, startup=True,
                          interactive=interactive, load_files=load_files)
     tscheme_exitonclick()
@@ -0,0 +1,92 @@
+"""Micro-benchmarks for the Scheme interpreter.
+
+Usage: python3 scheme_bench.py [SUITE ...]
+
+Each suite times a group of operations and prints the cost of each one in
+nanoseconds.  With no arguments, every suite is run.
+"""
+
+import timeit
+from scheme import (create_global_frame, scheme_analyze, cached_groups,
+                    read_groups)
+from scheme_codec import encode, decode
+from scheme_reader import read_line, pairs, nil
+from scheme_tokens import tokenize_line
+from ucb import main
+
+def best_time(fn, number):
+    """Return the least time in nanoseconds taken by a call of FN, over
+    several runs of NUMBER calls each."""
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e9
+
+# Calls of numeric primitives, with typical operands
+NUMERIC_CALLS = [
+    "(+ 3 4)", "(+ 1.5 2)", "(+ 1 2 3 4)", "(- 10 4)", "(- 5)", "(* 6 7)",
+    "(* 1180591620717411303424 3)", "(/ 10 2)", "(/ 5 2)", "(quotient 17 5)",
+    "(modulo 17 5)", "(= 3 3)", "(< 3 4)", "(> 3 4)", "(<= 3 4)", "(>= 3 4)",
+    "(even? 4)", "(zero? 0)",
+]
+
+def bench_primitives(number=100000):
+    """Print the cost of each call in NUMERIC_CALLS, both of the primitive's
+    Python function alone and of evaluating the call with the analyzer."""
+    env = create_global_frame()
+    print("{0:<32}{1:>10}{2:>10}".format("primitive call", "direct", "eval"))
+    for call in NUMERIC_CALLS:
+        expr = read_line(call)
+        fn = env.lookup(expr.first).fn
+        args = list(expr.second)
+        executor = scheme_analyze(expr)
+        direct = best_time(lambda: fn(*args), number)
+        evaluated = best_time(lambda: executor(env), number)
+        print("{0:<32}{1:>10.0f}{2:>10.0f}".format(call, direct, evaluated))
+
+def bench_tokens(path="tests.scm", number=20):
+    """Print the cost per line of tokenizing the file at PATH."""
+    with open(path) as f:
+        lines = f.readlines()
+    cost = best_time(lambda: [tokenize_line(line) for line in lines], number)
+    print("tokenize {0}: {1:.0f} per line".format(path, cost / len(lines)))
+
+def bench_load(path="questions.scm", number=20):
+    """Print the cost of reading the file at PATH, both by parsing it and from
+    its load cache."""
+    def parse():
+        with open(path) as f:
+            return read_groups(f)
+    def cached():
+        with open(path) as f:
+            return cached_groups(f)
+    cached()
+    print("load {0}: parse {1:.0f}, cached {2:.0f}".format(
+        path, best_time(parse, number), best_time(cached, number)))
+
+def bench_codec(path="questions.scm", number=20):
+    """Print the cost and size of round-tripping values through their printed
+    text and read_line, and through the binary encoding of scheme_codec: the
+    program in the file at PATH as one list, a long list of numbers, and a
+    list that shares one sublist many times."""
+    with open(path) as f:
+        program = pairs([e for group in read_groups(f) for e in group], nil)
+    numbers = pairs(list(range(10000)), nil)
+    shared = pairs([program] * 100, nil)
+    print("{0:<12}{1:>12}{2:>12}{3:>10}{4:>10}".format(
+        "value", "text", "codec", "text B", "codec B"))
+    for name, value in [(path, program), ("numbers", numbers),
+                        ("shared", shared)]:
+        text = best_time(lambda: read_line(str(value)), number)
+        codec = best_time(lambda: decode(encode(value)), number)
+        print("{0:<12}{1:>12.0f}{2:>12.0f}{3:>10}{4:>10}".format(
+            name, text, codec, len(str(value).encode()), len(encode(value))))
+
+SUITES = {
+    "primitives": bench_primitives,
+    "tokens": bench_tokens,
+    "load": bench_load,
+    "codec": bench_codec,
+}
+
+@main
+def run(*argv):
+    for name in argv or SUITES:
+        SUITES[name]()
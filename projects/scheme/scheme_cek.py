@@ -0,0 +1,212 @@
+"""This module implements an evaluator for Scheme that keeps its continuation
+on an explicit stack, in the style of a CEK machine (Control, Environment,
+Kontinuation).
+
+The evaluators in scheme.py use the Python stack for every operand and every
+non-tail call, so deeply recursive Scheme programs exceed Python's recursion
+limit.  This evaluator never calls itself.  Instead, it records the work that
+remains after each subexpression as a continuation frame on a Python list, so
+the depth of recursion is limited only by memory.
+
+Usage: python3 scheme.py -cek [FILE]
+"""
+
+from scheme import *
+
+# Kinds of continuation frames. Each frame is a tuple (kind, data, extra, env)
+# that receives the value of a subexpression evaluated in env.
+(IF_TEST, DEFINE_VALUE, BEGIN_REST, AND_REST, OR_REST, COND_TEST, LET_VALUE,
+ CALL_OPERAND) = range(8)
+
+def scheme_cek_eval(expr, env):
+    """Evaluate Scheme expression EXPR in environment ENV without using the
+    Python stack for recursion.
+
+    >>> env = create_global_frame()
+    >>> scheme_cek_eval(read_line("(define (f n) (if (= n 0) 0 (+ n (f (- n 1)))))"), env)
+    'f'
+    >>> scheme_cek_eval(read_line("(f 20000)"), env)
+    200010000
+    """
+    stack = []
+    depth = 0
+    try:
+        while True:
+            # Evaluate EXPR in ENV, either producing a VALUE or pushing a
+            # continuation frame and continuing with a subexpression.
+            if expr is None:
+                raise SchemeError("Cannot evaluate an undefined expression.")
+            if scheme_symbolp(expr):
+                value = env.lookup(expr)
+            elif scheme_atomp(expr) or scheme_stringp(expr) or expr is okay:
+                value = expr
+            elif not scheme_listp(expr):
+                raise SchemeError("malformed list: {0}".format(str(expr)))
+            else:
+                first, rest = expr.first, expr.second
+                if first is QUOTE:
+                    value = do_quote_form(rest)
+                elif first is LAMBDA:
+                    value = do_lambda_form(rest, env)
+                elif first is MU:
+                    value = do_mu_form(rest)
+                elif first is DELAY or first is DELAY_FORCE:
+                    value = do_delay_form(rest, env, first is DELAY_FORCE)
+                elif first is CONS_STREAM:
+                    expr = stream_pair(rest)
+                    continue
+                elif first is IF:
+                    check_form(rest, 2, 3)
+                    stack.append((IF_TEST, rest, None, env))
+                    expr = rest.first
+                    continue
+                elif first is DEFINE or first is DEFINE_MEMOIZED:
+                    if first is DEFINE_MEMOIZED:
+                        rest = memoized_definition(rest)
+                    check_form(rest, 2)
+                    if not scheme_symbolp(rest.first):
+                        value = do_define_form(rest, env)
+                    else:
+                        check_form(rest, 2, 2)
+                        stack.append((DEFINE_VALUE, rest.first, None, env))
+                        expr = rest.second.first
+                        continue
+                elif first is BEGIN:
+                    check_form(rest, 1)
+                    expr = push_sequence(rest, env, stack)
+                    continue
+                elif first is AND or first is OR:
+                    if rest is nil:
+                        value = first is AND
+                    else:
+                        if rest.second is not nil:
+                            kind = AND_REST if first is AND else OR_REST
+                            stack.append((kind, rest.second, None, env))
+                        expr = rest.first
+                        continue
+                elif first is COND:
+                    expr = push_clause(rest, env, stack)
+                    continue
+                elif first is LET:
+                    expr, env = push_let(rest, env, stack)
+                    continue
+                else:
+                    stack.append((CALL_OPERAND, rest, [], env))
+                    expr = first
+                    continue
+
+            # Return VALUE to the continuation frames on the stack, until one
+            # of them provides another expression to evaluate.
+            while True:
+                if not stack:
+                    return value
+                kind, data, extra, frame_env = stack.pop()
+                if kind == CALL_OPERAND:
+                    extra.append(value)
+                    if data is not nil:
+                        stack.append((CALL_OPERAND, data.second, extra,
+                                      frame_env))
+                        expr, env = data.first, frame_env
+                        break
+                    procedure, args = extra[0], extra[1:]
+                    stats.steps += 1
+                    if isinstance(procedure, PrimitiveProcedure):
+                        value = procedure.apply(args, frame_env)
+                        continue
+                    elif isinstance(procedure, LambdaProcedure):
+                        parent = procedure.env
+                    elif isinstance(procedure, MuProcedure):
+                        parent = frame_env
+                    else:
+                        msg = "Cannot call {0}".format(str(procedure))
+                        raise SchemeError(msg)
+                    stats.applications += 1
+                    if len(stack) > depth:
+                        depth = len(stack)
+                    env = bind_arguments(parent, call_scope(procedure), args)
+                    expr = procedure.body
+                    break
+                elif kind == IF_TEST:
+                    if value is not False:
+                        expr = data.second.first
+                    elif data.second.second is nil:
+                        value = okay
+                        continue
+                    else:
+                        expr = data.second.second.first
+                    env = frame_env
+                    break
+                elif kind == BEGIN_REST:
+                    expr = push_sequence(data, frame_env, stack)
+                    env = frame_env
+                    break
+                elif kind == AND_REST or kind == OR_REST:
+                    if (value is False) == (kind == AND_REST):
+                        continue
+                    if data.second is not nil:
+                        stack.append((kind, data.second, None, frame_env))
+                    expr, env = data.first, frame_env
+                    break
+                elif kind == COND_TEST:
+                    clause = data.first
+                    if value is False:
+                        expr = push_clause(data.second, frame_env, stack)
+                    elif clause.second is nil:
+                        continue
+                    else:
+                        expr = push_sequence(clause.second, frame_env, stack)
+                    env = frame_env
+                    break
+                elif kind == LET_VALUE:
+                    extra.append(value)
+                    formals, exprs, body = data
+                    if len(extra) < len(exprs):
+                        stack.append((LET_VALUE, data, extra, frame_env))
+                        expr, env = exprs[len(extra)], frame_env
+                        break
+                    env = bind_let(formals, extra, frame_env)
+                    expr = push_sequence(body, env, stack)
+                    break
+                elif kind == DEFINE_VALUE:
+                    frame_env.define(data, value)
+                    value = data
+    finally:
+        if depth > stats.peak_stack:
+            stats.peak_stack = depth
+
+def push_sequence(exprs, env, stack):
+    """Return the first expression in the non-empty Scheme list EXPRS, after
+    pushing a frame to evaluate the rest of them in ENV onto STACK."""
+    if exprs.second is not nil:
+        stack.append((BEGIN_REST, exprs.second, None, env))
+    return exprs.first
+
+def push_clause(clauses, env, stack):
+    """Return the next expression to evaluate for the remaining cond CLAUSES
+    in ENV, pushing a frame to receive the value of its test onto STACK."""
+    if clauses is nil:
+        return okay
+    clause = clauses.first
+    check_form(clause, 1)
+    if clause.first is ELSE:
+        if clauses.second is not nil:
+            raise SchemeError("else must be last")
+        if clause.second is nil:
+            raise SchemeError("badly formed else clause")
+        return push_sequence(clause.second, env, stack)
+    stack.append((COND_TEST, clauses, None, env))
+    return clause.first
+
+def push_let(vals, env, stack):
+    """Return the next expression and environment for the let form with
+    parameters VALS in ENV, pushing a frame that binds its names onto STACK."""
+    parts = formals, exprs, body = let_parts(vals)
+    if not exprs:
+        new_env = bind_let(formals, [], env)
+        return push_sequence(body, new_env, stack), new_env
+    stack.append((LET_VALUE, parts, [], env))
+    return exprs[0], env
+
+def bind_let(formals, values, env):
+    """Return a frame extending ENV that binds FORMALS to VALUES."""
+    return bind_arguments(env, Scope(formals, (), frame_scope(env)), values)
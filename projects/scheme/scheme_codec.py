@@ -0,0 +1,209 @@
+"""This module implements a compact binary encoding of Scheme values, including
+the expressions of a parsed program.
+
+An encoding is the MAGIC bytes followed by the instructions of a stack
+machine that rebuilds the value.  Each instruction is a tag byte, possibly
+followed by an argument.  Atoms push themselves, and PAIRS k pops a first and
+second element k times, pushing a pair built from them each time, so a list
+of n elements is encoded as its elements, its tail, and then PAIRS n.
+
+Every pair that is decoded is numbered in the order it is built.  A pair
+that appears more than once in a value is encoded once and then referred to
+by its number, so shared substructure is preserved.  Symbols are likewise
+numbered the first time they appear.  Both the encoder and the decoder keep
+their work on Python lists, so the length and depth of a value are limited
+only by memory.
+
+Numbers are encoded as zigzag variable-length integers (any size) or as
+8-byte floats.  Strings and symbols are UTF-8.
+"""
+
+import struct
+
+from scheme_reader import Pair, nil, Symbol, String, read_line
+from scheme_primitives import okay
+
+MAGIC = b"SCM\x01"
+
+# Tags of instructions
+(NIL, TRUE, FALSE, OKAY, NONE, INT, FLOAT, STRING, SYMBOL, NEW_SYMBOL,
+ PAIRS, REF) = range(12)
+
+_FLOAT = struct.Struct("<d")
+
+# Tags of the values that are encoded by their tag alone
+_CONSTANTS = {True: TRUE, False: FALSE}
+_SINGLETONS = {id(nil): NIL, id(okay): OKAY, id(None): NONE}
+
+# A marker on the stack of the encoder
+_DONE = object()
+
+def encode(value):
+    """Return the bytes encoding the Scheme VALUE.
+
+    >>> s = read_line("(define (f x) (+ x 1.5 \\"a\\" #t))")
+    >>> decode(encode(s)) == s
+    True
+    >>> shared = Pair(1, nil)
+    >>> t = decode(encode(Pair(shared, shared)))
+    >>> t.first is t.second
+    True
+    >>> len(encode(read_line("(a a a a)"))) - len(MAGIC)
+    12
+    """
+    out = bytearray(MAGIC)
+    pairs = {}      # id of each encoded pair -> its number
+    symbols = {}    # each encoded symbol -> its number
+    active = set()  # ids of the pairs whose elements are being encoded
+    pending = 0     # pairs whose PAIRS instruction is being accumulated
+
+    # Values to encode, in reverse order.  A pair whose elements have been
+    # encoded follows _DONE, and is then numbered.
+    stack = [value]
+    pop, push = stack.pop, stack.extend
+    while stack:
+        value = pop()
+        if value is _DONE:
+            key = id(pop())
+            active.discard(key)
+            pairs[key] = len(pairs)
+            pending += 1
+            continue
+        if pending:
+            out.append(PAIRS)
+            _write_varint(out, pending)
+            pending = 0
+        kind = type(value)
+        if kind is Pair:
+            key = id(value)
+            if key in pairs:
+                out.append(REF)
+                _write_varint(out, pairs[key])
+                continue
+            if key in active:
+                raise ValueError("cannot encode a cyclic structure")
+            active.add(key)
+            push((value, _DONE, value.second, value.first))
+        elif kind is int:
+            out.append(INT)
+            _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif kind is Symbol:
+            if value in symbols:
+                out.append(SYMBOL)
+                _write_varint(out, symbols[value])
+            else:
+                symbols[value] = len(symbols)
+                out.append(NEW_SYMBOL)
+                _write_text(out, value)
+        elif id(value) in _SINGLETONS:
+            out.append(_SINGLETONS[id(value)])
+        elif kind is bool:
+            out.append(_CONSTANTS[value])
+        elif kind is float:
+            out.append(FLOAT)
+            out += _FLOAT.pack(value)
+        elif kind is String:
+            out.append(STRING)
+            _write_text(out, value)
+        else:
+            raise TypeError("cannot encode {0}".format(repr(value)))
+    if pending:
+        out.append(PAIRS)
+        _write_varint(out, pending)
+    return bytes(out)
+
+def decode(data):
+    """Return the Scheme value encoded in the bytes DATA.
+
+    >>> decode(encode(read_line("(1 (2 . x) -300 ())")))
+    Pair(1, Pair(Pair(2, 'x'), Pair(-300, Pair(nil, nil))))
+    >>> decode(b"not scheme")
+    Traceback (most recent call last):
+        ...
+    ValueError: not an encoded Scheme value
+    """
+    if not data.startswith(MAGIC):
+        raise ValueError("not an encoded Scheme value")
+    stack, pairs, symbols = [], [], []
+    pos, end = len(MAGIC), len(data)
+    try:
+        while pos < end:
+            tag = data[pos]
+            pos += 1
+            if tag == PAIRS:
+                count, pos = _read_varint(data, pos)
+                for _ in range(count):
+                    second = stack.pop()
+                    pair = Pair(stack.pop(), second)
+                    pairs.append(pair)
+                    stack.append(pair)
+            elif tag == REF:
+                index, pos = _read_varint(data, pos)
+                stack.append(pairs[index])
+            elif tag == SYMBOL:
+                index, pos = _read_varint(data, pos)
+                stack.append(symbols[index])
+            elif tag == NEW_SYMBOL:
+                text, pos = _read_text(data, pos)
+                symbols.append(Symbol(text))
+                stack.append(symbols[-1])
+            elif tag == INT:
+                n, pos = _read_varint(data, pos)
+                stack.append(n >> 1 if not n & 1 else -(n >> 1) - 1)
+            elif tag == FLOAT:
+                stack.append(_FLOAT.unpack_from(data, pos)[0])
+                pos += _FLOAT.size
+            elif tag == STRING:
+                text, pos = _read_text(data, pos)
+                stack.append(String(text))
+            elif tag == NIL:
+                stack.append(nil)
+            elif tag == TRUE:
+                stack.append(True)
+            elif tag == FALSE:
+                stack.append(False)
+            elif tag == OKAY:
+                stack.append(okay)
+            elif tag == NONE:
+                stack.append(None)
+            else:
+                raise ValueError("unknown tag {0}".format(tag))
+    except (IndexError, struct.error):
+        raise ValueError("truncated or malformed encoding")
+    if len(stack) != 1:
+        raise ValueError("truncated or malformed encoding")
+    return stack[0]
+
+def _write_varint(out, n):
+    """Append the non-negative integer N to the bytearray OUT, seven bits per
+    byte with the high bit set on all but the last."""
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(data, pos):
+    """Return the integer written by _write_varint at POS in DATA and the
+    position after it."""
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+def _write_text(out, text):
+    """Append the length and UTF-8 bytes of TEXT to OUT."""
+    raw = text.encode("utf-8")
+    _write_varint(out, len(raw))
+    out += raw
+
+def _read_text(data, pos):
+    """Return the text written by _write_text at POS in DATA and the position
+    after it."""
+    size, pos = _read_varint(data, pos)
+    if pos + size > len(data):
+        raise IndexError
+    return bytes(data[pos:pos+size]).decode("utf-8"), pos + size
@@ -0,0 +1,434 @@
+"""This module implements constant folding, a pass that simplifies a Scheme
+expression before it is evaluated.
+
+The pass makes these changes, each only where it cannot change the value of
+the expression:
+- A call of a pure primitive whose operands are all constants is replaced by
+  its value, such as (* 60 60 24) by 86400 and (car '(1 2)) by 1.  A call is
+  folded only if the operator names the built-in primitive in the
+  environment of the expression, no enclosing form binds that name, and
+  nothing can redefine it before the call is evaluated (see fold).
+- An if form whose test is a constant is replaced by the branch it selects,
+  and the clauses of a cond form that follow a constant true test or have a
+  constant false test are removed.
+- A let binding whose value is a constant is substituted into the body, and
+  removed if nothing in the body may apply a mu procedure, which could look
+  the binding up.
+
+Calls that raise an error, and malformed forms, are left to raise their
+errors when they are evaluated.  The bodies of mu expressions are not
+folded, since any name in them may be bound by the caller.
+
+Folding is enabled by the -fold flag of scheme.py, and -fold-dump also prints
+each expression that folding changes to standard error.
+
+Usage: python3 scheme.py -fold [FILE]
+"""
+
+import sys
+
+from scheme import *
+from scheme_primitives import _PRIMITIVES
+
+# The primitives whose values depend only on their arguments, without side
+# effects or newly allocated pairs
+PURE = frozenset([
+    "boolean?", "not", "equal?", "pair?", "null?", "list?", "length", "car",
+    "cdr", "list-tail", "string?", "symbol?", "number?", "integer?", "+", "-",
+    "*", "/", "quotient", "modulo", "remainder", "floor", "ceil", "=", "<",
+    ">", "<=", ">=", "even?", "odd?", "zero?", "atom?",
+])
+
+# The built-in procedure of each pure primitive
+BUILT_IN = {name: proc for name, proc in _PRIMITIVES if name in PURE}
+
+def folding(evaluate, dump=False):
+    """Return an evaluator that folds each expression and then evaluates it
+    with EVALUATE.  Expressions evaluated while another is being evaluated,
+    such as subexpressions passed back to the evaluator, are not folded again.
+    If DUMP is true, each expression that folding changes is printed to
+    standard error."""
+    active = False
+    def evaluate_folded(expr, env):
+        nonlocal active
+        if active:
+            return evaluate(expr, env)
+        folded = fold(expr, env)
+        if dump and folded is not expr:
+            print("; folded:", folded, file=sys.stderr)
+        active = True
+        try:
+            return evaluate(folded, env)
+        finally:
+            active = False
+    return evaluate_folded
+
+def fold(expr, env):
+    """Return EXPR with constants folded, for evaluation in environment ENV.
+    Subexpressions that are unchanged are returned as they are.
+
+    Calls are folded only in code that EXPR evaluates at once, and only if
+    that code applies no procedures other than the pure primitives, so that
+    no primitive can be redefined between folding and the call.  The bodies
+    of procedures and promises are evaluated later, when a primitive may have
+    been redefined, so calls in them are left alone.
+
+    >>> env = create_global_frame()
+    >>> print(fold(read_line("(define day (* 60 60 24))"), env))
+    (define day 86400)
+    >>> print(fold(read_line("(let ((car cdr)) (car '(1 2)))"), env))
+    (let ((car cdr)) (car (quote (1 2))))
+    >>> print(fold(read_line("(define (f) (if #t (* 60 60) 0))"), env))
+    (define (f) (* 60 60))
+    >>> print(fold(read_line("(display (* 60 60))"), env))
+    (display (* 60 60))
+    >>> print(fold(read_line("(if (> 2 1) (cdr '(1 2)) 'none)"), env))
+    (quote (2))
+    >>> print(fold(read_line("(let ((x 2) (y 3)) (* x y 7))"), env))
+    42
+    >>> print(fold(read_line("(lambda () (let ((x 2) (y (f))) (+ x y)))"),
+    ...            env))
+    (lambda () (let ((x 2) (y (f))) (+ 2 y)))
+    >>> print(fold(read_line("(let ((x 5)) (define y 3) x)"), env))
+    (let () (define y 3) 5)
+    >>> print(fold(read_line("(let ((x 1) (x 2)) x)"), env))
+    (let ((x 1) (x 2)) x)
+    """
+    bound = frozenset(scan_defines(expr, []))
+    try:
+        if not applies_only_pure(expr, bound, env):
+            env = None
+        return fold_expr(expr, bound, env)
+    except RecursionError:
+        return expr
+
+def fold_expr(expr, bound, env):
+    """Fold EXPR, in which the names in the set BOUND are bound locally.
+    Calls are folded only if ENV is an environment rather than None."""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return expr
+    first, rest = expr.first, expr.second
+    try:
+        if first is QUOTE or first is MU:
+            return expr
+        elif first is LAMBDA:
+            check_form(rest, 2)
+            body = fold_body(rest.second, rest.first, bound)
+            return rebuild(expr, [first, rest.first], body)
+        elif first is DEFINE or first is DEFINE_MEMOIZED:
+            check_form(rest, 2)
+            target = rest.first
+            if isinstance(target, Pair):
+                body = fold_body(rest.second, target.second, bound)
+                return rebuild(expr, [first, target], body)
+            return rebuild(expr, [first, target],
+                           fold_list(rest.second, bound, env))
+        elif first is DELAY or first is DELAY_FORCE:
+            return rebuild(expr, [first], fold_list(rest, bound, None))
+        elif first is CONS_STREAM:
+            check_form(rest, 2, 2)
+            return rebuild(expr, [first, fold_expr(rest.first, bound, env)],
+                           fold_list(rest.second, bound, None))
+        elif first is LET:
+            return fold_let(expr, bound, env)
+        elif first is IF:
+            return fold_if(expr, bound, env)
+        elif first is COND:
+            return fold_cond(expr, bound, env)
+    except SchemeError:
+        return expr  # Malformed forms raise their errors when evaluated
+    folded = fold_list(expr, bound, env)
+    if scheme_symbolp(first) and first in ANALYZERS:
+        return folded
+    return fold_call(folded, bound, env)
+
+def fold_list(exprs, bound, env):
+    """Fold each expression in the Scheme list EXPRS, returning EXPRS itself
+    if none of them change."""
+    items, s = [], exprs
+    while s is not nil:
+        items.append(fold_expr(s.first, bound, env))
+        s = s.second
+    return rebuild(exprs, items, nil)
+
+def fold_body(exprs, formals, bound):
+    """Fold the body EXPRS of a procedure with FORMALS, which may also be a
+    single symbol for a variadic procedure.  Calls are not folded, since the
+    body is evaluated after its primitives may have been redefined."""
+    names = set(bound)
+    while isinstance(formals, Pair):
+        names.add(formals.first)
+        formals = formals.second
+    if scheme_symbolp(formals):
+        names.add(formals)
+    defined = []
+    s = exprs
+    while s is not nil:
+        scan_defines(s.first, defined)
+        s = s.second
+    return fold_list(exprs, frozenset(names.union(defined)), None)
+
+def fold_call(expr, bound, env):
+    """Replace the call EXPR, whose operands have been folded, by its value if
+    it calls a pure primitive on constants."""
+    name = expr.first
+    if not is_built_in(name, bound, env):
+        return expr
+    args, s = [], expr.second
+    while s is not nil:
+        if not is_constant(s.first):
+            return expr
+        args.append(constant_value(s.first))
+        s = s.second
+    try:
+        value = BUILT_IN[name].apply(args, env)
+    except (SchemeError, ArithmeticError, TypeError, ValueError):
+        return expr
+    literal = literal_expr(value)
+    return expr if literal is None else literal
+
+def is_built_in(name, bound, env):
+    """Whether NAME refers to a built-in pure primitive where the names in
+    BOUND are bound locally, in environment ENV (None if unknown)."""
+    if (env is None or not scheme_symbolp(name) or name not in BUILT_IN or
+            name in bound):
+        return False
+    try:
+        return env.lookup(name) is BUILT_IN[name]
+    except SchemeError:
+        return False
+
+def fold_if(expr, bound, env):
+    """Fold an if form, choosing a branch if its test is a constant."""
+    check_form(expr.second, 2, 3)
+    folded = fold_list(expr.second, bound, env)
+    test, branches = folded.first, folded.second
+    if not is_constant(test):
+        return rebuild(expr, [IF], folded)
+    if scheme_true(constant_value(test)):
+        return branches.first
+    if branches.second is nil:
+        return okay
+    return branches.second.first
+
+def fold_cond(expr, bound, env):
+    """Fold a cond form, removing clauses whose tests are constant false and
+    clauses after one whose test is constant true."""
+    clauses, changed, s = [], False, expr.second
+    while s is not nil:
+        clause = s.first
+        check_form(clause, 1)
+        s = s.second
+        if clause.first is ELSE:
+            if s is not nil:
+                raise SchemeError("else must be last")
+            if clause.second is nil:
+                raise SchemeError("badly formed else clause")
+            folded = rebuild(clause, [ELSE], fold_list(clause.second, bound,
+                                                        env))
+            clauses.append(folded)
+            changed |= folded is not clause
+            break
+        folded = fold_list(clause, bound, env)
+        test = folded.first
+        if is_constant(test) and not scheme_true(constant_value(test)):
+            changed = True
+            continue
+        if is_constant(test) and folded.second is not nil:
+            clauses.append(Pair(ELSE, folded.second))
+            changed = True
+            break
+        clauses.append(folded)
+        changed |= folded is not clause
+        if is_constant(test):
+            changed |= s is not nil
+            break
+    if not changed:
+        return expr
+    if clauses and clauses[0].first is ELSE:
+        return sequence(clauses[0].second)
+    return pairs([COND] + clauses, nil)
+
+def fold_let(expr, bound, env):
+    """Fold a let form, substituting the bindings whose values are constants
+    into its body."""
+    formals, value_exprs, body = let_parts(expr.second)
+    names = list(formals) if formals is not nil else []
+    values = [fold_expr(value, bound, env) for value in value_exprs]
+    defined = []
+    s = body
+    while s is not nil:
+        scan_defines(s.first, defined)
+        s = s.second
+    constants, kept = {}, []
+    for name, value in zip(names, values):
+        if is_constant(value) and name not in defined and name not in kept:
+            constants[name] = value
+        else:
+            kept.append(name)
+    body = substitute_list(body, constants)
+    inner = frozenset(bound.union(names, defined))
+    if any(may_apply_mu(e, inner, env) for e in body):
+        kept = names  # A mu procedure may look up any binding of its caller
+    body = fold_list(body, frozenset(bound.union(kept, defined)), env)
+    if not kept and not defined:
+        return sequence(body)
+    bindings, items = expr.second.first, []
+    for binding, value in zip(bindings, values):
+        if binding.first in kept:
+            items.append(rebuild(binding, [binding.first, value], nil))
+    return rebuild(expr, [LET, rebuild(bindings, items, nil)], body)
+
+def applies_only_pure(expr, bound, env):
+    """Whether evaluating EXPR at once applies no procedures other than the
+    built-in pure primitives.  Procedures and promises that it creates are
+    not applied."""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return True
+    first, rest = expr.first, expr.second
+    if first in (QUOTE, LAMBDA, MU, DELAY, DELAY_FORCE, DEFINE_MEMOIZED):
+        return True
+    elif first is DEFINE and rest is not nil and isinstance(rest.first, Pair):
+        return True
+    elif first is DEFINE:
+        exprs = rest.second if rest is not nil else nil
+    elif first is CONS_STREAM:
+        exprs = Pair(rest.first, nil) if rest is not nil else nil
+    elif first is LET:
+        if rest is nil or not scheme_listp(rest.first):
+            return False
+        exprs = rest.second
+        for binding in rest.first:
+            if scheme_listp(binding) and binding is not nil and not all(
+                    applies_only_pure(e, bound, env) for e in binding.second):
+                return False
+    elif first is COND:
+        exprs = [e for clause in rest if scheme_listp(clause)
+                 for e in clause if e is not ELSE]
+    elif (scheme_symbolp(first) and first in ANALYZERS or
+          is_built_in(first, bound, env)):
+        exprs = rest
+    else:
+        return False
+    return all(applies_only_pure(e, bound, env) for e in exprs)
+
+def may_apply_mu(expr, bound, env):
+    """Whether evaluating EXPR, or calling a procedure that it creates, may
+    apply a mu procedure, which looks up names in the frame of its caller.
+    Only calls of the built-in pure primitives are known not to."""
+    if not isinstance(expr, Pair) or not scheme_listp(expr):
+        return False
+    first, rest = expr.first, expr.second
+    if first is QUOTE:
+        return False
+    elif first is MU:
+        return True
+    elif first is LAMBDA or first is DEFINE or first is DEFINE_MEMOIZED:
+        exprs = rest.second if rest is not nil else nil
+    elif first is LET:
+        if rest is nil or not scheme_listp(rest.first):
+            return True
+        exprs = rest.second
+        for binding in rest.first:
+            if scheme_listp(binding) and binding is not nil and any(
+                    may_apply_mu(e, bound, env) for e in binding.second):
+                return True
+    elif first is COND:
+        exprs = [e for clause in rest if scheme_listp(clause)
+                 for e in clause if e is not ELSE]
+    elif scheme_symbolp(first) and first in ANALYZERS:
+        exprs = rest
+    elif is_built_in(first, bound, env):
+        exprs = rest
+    else:
+        return True
+    return any(may_apply_mu(e, bound, env) for e in exprs)
+
+def substitute(expr, constants):
+    """Return EXPR with each free occurrence of a name in the dict CONSTANTS
+    replaced by its constant expression."""
+    if scheme_symbolp(expr):
+        return constants.get(expr, expr)
+    if not constants or not isinstance(expr, Pair) or not scheme_listp(expr):
+        return expr
+    first, rest = expr.first, expr.second
+    if first is QUOTE or first is MU:
+        return expr
+    if first is LAMBDA or first is DEFINE or first is DEFINE_MEMOIZED:
+        if rest is nil:
+            return expr
+        formals = rest.first
+        if first is not LAMBDA:
+            if not isinstance(formals, Pair):
+                return rebuild(expr, [first, formals],
+                               substitute_list(rest.second, constants))
+            formals = formals.second
+        inner = unbind(constants, formals, rest.second)
+        return rebuild(expr, [first, rest.first],
+                       substitute_list(rest.second, inner))
+    if first is LET and isinstance(rest, Pair) and scheme_listp(rest.first):
+        bindings, names = [], []
+        for binding in rest.first:
+            if scheme_listp(binding) and isinstance(binding.second, Pair):
+                names.append(binding.first)
+                binding = rebuild(binding, [binding.first],
+                                  substitute_list(binding.second, constants))
+            bindings.append(binding)
+        inner = unbind(constants, pairs(names, nil), rest.second)
+        return rebuild(expr, [LET, rebuild(rest.first, bindings, nil)],
+                       substitute_list(rest.second, inner))
+    return substitute_list(expr, constants)
+
+def substitute_list(exprs, constants):
+    """Substitute CONSTANTS in each expression of the Scheme list EXPRS."""
+    items, s = [], exprs
+    while s is not nil:
+        items.append(substitute(s.first, constants))
+        s = s.second
+    return rebuild(exprs, items, nil)
+
+def unbind(constants, formals, body):
+    """Return the dict CONSTANTS without the names bound by FORMALS or
+    defined in BODY."""
+    names = []
+    while isinstance(formals, Pair):
+        names.append(formals.first)
+        formals = formals.second
+    names.append(formals)
+    s = body
+    while isinstance(s, Pair):
+        scan_defines(s.first, names)
+        s = s.second
+    return {k: v for k, v in constants.items() if k not in names}
+
+def rebuild(expr, items, tail):
+    """Return the Scheme list of ITEMS followed by TAIL, or EXPR if that list
+    has the same elements and tail as EXPR."""
+    s = expr
+    for item in items:
+        if not isinstance(s, Pair) or s.first is not item:
+            return pairs(items, tail)
+        s = s.second
+    return expr if s is tail else pairs(items, tail)
+
+def is_constant(expr):
+    """Whether EXPR is a self-evaluating value or a quotation."""
+    if type(expr) in (int, float, bool, String):
+        return True
+    return (isinstance(expr, Pair) and expr.first is QUOTE and
+            isinstance(expr.second, Pair) and expr.second.second is nil)
+
+def constant_value(expr):
+    """Return the value of the constant expression EXPR."""
+    if isinstance(expr, Pair):
+        return expr.second.first
+    return expr
+
+def literal_expr(value):
+    """Return an expression that evaluates to VALUE, or None if there is
+    none."""
+    if type(value) in (int, float, bool, String):
+        return value
+    if isinstance(value, Pair) or value is nil or scheme_symbolp(value):
+        return Pair(QUOTE, Pair(value, nil))
+    return None
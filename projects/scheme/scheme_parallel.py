@@ -0,0 +1,206 @@
+"""This module implements parallel-map, which applies a Scheme procedure to the
+elements of a list in a pool of worker processes.
+
+Each worker creates its own global environment once and reuses it for every
+task.  A task carries the procedure, its environment, and the definitions of
+the global environment that sent it, pickled so that built-in procedures and
+the global frame itself are sent by name and resolved in the receiving
+process.  Values returned by the workers are pickled in the same way.
+
+Procedures applied in parallel should be pure: changes that they make to their
+environments happen in the workers and are not seen by the caller.
+"""
+
+import io
+import multiprocessing
+import pickle
+
+from scheme import *
+
+# Pools of worker processes, keyed by their number of processes
+_pools = {}
+
+# The global environment of this process, when it is a worker
+_worker_env = None
+
+# The last procedure received by this worker, as (payload, procedure)
+_worker_procedure = (None, None)
+
+def parallel_map(procedure, s, *options):
+    """Return a list of the values of PROCEDURE applied to each element of the
+    list S.  OPTIONS are up to two optional arguments, WORKERS and TIMEOUT,
+    followed by the calling environment.  The values are computed by a pool
+    of WORKERS processes (by default, one for each CPU), and a SchemeError is
+    raised if any application fails or if the values are not all computed
+    within TIMEOUT seconds."""
+    *options, env = options
+    if len(options) > 2:
+        raise SchemeError("parallel-map expects 2 to 4 arguments, got {0}"
+                          .format(len(options) + 2))
+    workers, timeout = options + [None] * (2 - len(options))
+    items = []
+    check_type(s, scheme_listp, 1, "parallel-map")
+    while s is not nil:
+        items.append(s.first)
+        s = s.second
+    if workers is not None:
+        check_type(workers, lambda k: type(k) is int and k > 0, 2,
+                   "parallel-map")
+    if timeout is not None:
+        check_type(timeout, lambda t: type(t) in (int, float) and t > 0, 3,
+                   "parallel-map")
+    if not items:
+        return nil
+    global_env = env.global_frame()
+    try:
+        payload = dumps((procedure, user_bindings(global_env)), global_env)
+        tasks = [(payload, dumps(chunk, global_env))
+                 for chunk in chunks(items, workers or default_workers())]
+    except (pickle.PicklingError, TypeError, AttributeError,
+            RecursionError) as err:
+        raise SchemeError("parallel-map cannot send {0} to workers: {1}"
+                          .format(procedure, err))
+    pool = worker_pool(workers)
+    try:
+        results = pool.map_async(run_task, tasks).get(timeout)
+    except multiprocessing.TimeoutError:
+        pool.terminate()
+        del _pools[workers]
+        raise SchemeError("parallel-map timed out after {0} seconds"
+                          .format(timeout))
+    try:
+        results = [(ok, loads(data, global_env) if ok else data)
+                   for ok, data in results]
+    except (pickle.UnpicklingError, TypeError, AttributeError) as err:
+        raise SchemeError("parallel-map cannot receive values: {0}"
+                          .format(err))
+    values = []
+    for ok, data in results:
+        if not ok:
+            raise SchemeError(data)
+        values.extend(data)
+    return pairs(values, nil)
+
+def default_workers():
+    """The number of workers in a pool whose size is not given."""
+    return multiprocessing.cpu_count()
+
+def chunks(items, workers):
+    """Split the Python list ITEMS into about four chunks for each worker, so
+    that workers that finish early can take more of the work."""
+    size = max(1, -(-len(items) // (workers * 4)))
+    return [items[i:i+size] for i in range(0, len(items), size)]
+
+def worker_pool(workers):
+    """Return the pool of WORKERS processes, starting it on first use.  Workers
+    are forked where possible, so that they share the classes of this
+    process, including those of a scheme module run as a script."""
+    if workers not in _pools:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "fork" if "fork" in methods else None)
+        _pools[workers] = context.Pool(workers, initializer=start_worker)
+    return _pools[workers]
+
+def start_worker():
+    """Create the global environment of a worker process."""
+    global _worker_env
+    _worker_env = create_global_frame()
+
+def run_task(task):
+    """Apply a procedure to a chunk of arguments in a worker.  TASK is a pair
+    of payloads, one for the procedure with the global definitions that it
+    may use, and one for a Python list of arguments.  Return (True, payload)
+    for the list of values or (False, message) for an error."""
+    global _worker_procedure
+    payload, data = task
+    try:
+        if _worker_procedure[0] != payload:
+            procedure, bindings = loads(payload, _worker_env)
+            for name, value in bindings.items():
+                _worker_env.define(name, value)
+            _worker_procedure = (payload, procedure)
+        procedure = _worker_procedure[1]
+        values = [analyzed_apply(procedure, [arg], _worker_env)
+                  for arg in loads(data, _worker_env)]
+    except RecursionError:
+        return False, "maximum recursion depth exceeded"
+    except Exception as err:
+        return False, "{0}".format(err)
+    try:
+        return True, dumps(values, _worker_env)
+    except (pickle.PicklingError, TypeError, AttributeError) as err:
+        return False, "parallel-map cannot return values: {0}".format(err)
+
+def user_bindings(global_env):
+    """Return a dict of the bindings in GLOBAL_ENV that are not built in and
+    can be pickled, which procedures sent to workers may look up."""
+    bindings = {}
+    for name, value in global_env.bindings.items():
+        if is_builtin(global_env, name):
+            continue
+        try:
+            dumps(value, global_env)
+        except (pickle.PicklingError, TypeError, AttributeError,
+                RecursionError):
+            continue
+        bindings[name] = value
+    return bindings
+
+# The names bound in every new global environment
+_builtin_names = None
+
+def is_builtin(global_env, name):
+    """Whether NAME is bound in GLOBAL_ENV to a built-in procedure, which is
+    bound to the same name in every new global environment."""
+    global _builtin_names
+    if _builtin_names is None:
+        _builtin_names = frozenset(create_global_frame().bindings)
+    return (name in _builtin_names and
+            isinstance(global_env.bindings.get(name), PrimitiveProcedure))
+
+class EnvironmentPickler(pickle.Pickler):
+    """A Pickler that refers to the global frame GLOBAL_ENV, the built-in
+    procedures that it binds, and the unknown Scope by name."""
+
+    def __init__(self, file, global_env):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.global_env = global_env
+        self.primitives = {}
+        for name, value in global_env.bindings.items():
+            if is_builtin(global_env, name):
+                self.primitives.setdefault(id(value), name)
+
+    def persistent_id(self, obj):
+        if obj is self.global_env:
+            return "global"
+        elif obj is DYNAMIC:
+            return "dynamic"
+        elif type(obj) is PrimitiveProcedure and id(obj) in self.primitives:
+            return ("primitive", self.primitives[id(obj)])
+        return None
+
+class EnvironmentUnpickler(pickle.Unpickler):
+    """An Unpickler that resolves the names written by an EnvironmentPickler
+    in the global frame GLOBAL_ENV."""
+
+    def __init__(self, file, global_env):
+        super().__init__(file)
+        self.global_env = global_env
+
+    def persistent_load(self, pid):
+        if pid == "global":
+            return self.global_env
+        elif pid == "dynamic":
+            return DYNAMIC
+        return self.global_env.bindings[pid[1]]
+
+def dumps(value, global_env):
+    """Pickle VALUE, which may refer to the global frame GLOBAL_ENV."""
+    out = io.BytesIO()
+    EnvironmentPickler(out, global_env).dump(value)
+    return out.getvalue()
+
+def loads(data, global_env):
+    """Unpickle DATA, resolving global names in GLOBAL_ENV."""
+    return EnvironmentUnpickler(io.BytesIO(data), global_env).load()
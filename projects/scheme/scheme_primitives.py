@@ -1,9 +1,11 @@
 """This module implements the primitives of the Scheme language."""
 
+import inspect
 import math
 import operator
 import sys
-from scheme_reader import Pair, nil
+from scheme_reader import (Pair, nil, pairs, Symbol, String, Vector,
+                           HashTable, Promise, stats, equal_key)
 
 try:
     import turtle
@@ -18,6 +20,9 @@ class okay:
     def __repr__(self):
         return "okay"
 
+    def __reduce__(self):
+        return "okay"
+
 okay = okay() # Assignment hides the okay class; there is only one instance
 
 ########################
@@ -25,21 +30,83 @@ okay = okay() # Assignment hides the okay class; there is only one instance
 ########################
 
 class PrimitiveProcedure:
-    """A Scheme procedure defined as a Python function."""
+    """A Scheme procedure defined as a Python function.
+
+    The arity of a primitive is the range of argument counts that FN accepts,
+    not including the environment passed last when USE_ENV is true.  Calls
+    with a count in direct_arity may pass their arguments straight to FN.
+
+    >>> car = PrimitiveProcedure(lambda x: x.first)
+    >>> car.arity, car.apply([Pair(1, nil)], None)
+    (range(1, 2), 1)
+    >>> PrimitiveProcedure(lambda x, *vals: vals).apply([1, 2, 3], None)
+    (2, 3)
+    """
 
     def __init__(self, fn, use_env=False):
         self.fn = fn
         self.use_env = use_env
+        self.arity = arity(fn, use_env)
+        self.direct_arity = range(0) if use_env else self.arity
+
+    def apply(self, args, env):
+        """Apply SELF to the Python list ARGS in environment ENV."""
+        if len(args) not in self.arity:
+            raise SchemeError(arity_error(self, len(args)))
+        if self.use_env:
+            return self.fn(*args, env)
+        return self.fn(*args)
 
     def __str__(self):
         return '#[primitive]'
 
+def arity(fn, use_env=False):
+    """Return the range of the number of arguments accepted by FN, excluding a
+    final environment argument if USE_ENV is true.  A function with variable
+    arguments receives the environment among them, after all of its named
+    parameters.
+
+    >>> arity(lambda f, s, *rest: None, True).start
+    2
+    >>> arity(lambda x, y, env: None, True)
+    range(2, 3)
+    """
+    try:
+        parameters = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return range(sys.maxsize)
+    positional = [p for p in parameters if p.kind in
+                  (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    max_args = len(positional)
+    min_args = len([p for p in positional if p.default is p.empty])
+    if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+        if use_env:
+            min_args = len(positional)
+        max_args = sys.maxsize - 1
+    elif use_env:
+        min_args, max_args = max(min_args - 1, 0), max_args - 1
+    return range(min_args, max_args + 1)
+
+def arity_error(procedure, count):
+    """Return a message for a call of PROCEDURE with COUNT arguments."""
+    low, high = procedure.arity.start, procedure.arity.stop - 1
+    if high == sys.maxsize - 1:
+        expected = "at least {0}".format(low)
+    elif low == high:
+        expected = str(low)
+    else:
+        expected = "{0} to {1}".format(low, high)
+    return "{0} expects {1} argument{2}, got {3}".format(
+        procedure, expected, "" if expected == "1" else "s", count)
+
 _PRIMITIVES = []
 
-def primitive(*names):
-    """An annotation to convert a Python function into a PrimitiveProcedure."""
+def primitive(*names, use_env=False):
+    """An annotation to convert a Python function into a PrimitiveProcedure.
+    If USE_ENV is true, the function is passed the calling environment after
+    its arguments."""
     def add(fn):
-        proc = PrimitiveProcedure(fn)
+        proc = PrimitiveProcedure(fn, use_env)
         for name in names:
             _PRIMITIVES.append((name,proc))
         return fn
@@ -74,9 +141,49 @@ def scheme_false(val):
 def scheme_not(x):
     return not scheme_true(x)
 
-@primitive("eq?", "equal?")
-def scheme_eqp(x, y):
-    return x == y
+@primitive("eq?", "eqv?")
+def scheme_eqvp(x, y):
+    """Whether X and Y are the same object, or numbers of the same exactness
+    with equal values.  Numbers are compared by value for eq? as well, since
+    equal numbers need not be the same Python object, so eq? and eqv? are
+    the same procedure.
+
+    >>> scheme_eqvp(2, 2), scheme_eqvp(2, 2.0)
+    (True, False)
+    """
+    if x is y:
+        return True
+    return type(x) is type(y) and type(x) in (int, float) and x == y
+
+@primitive("equal?")
+def scheme_equalp(x, y):
+    """Whether X and Y are eqv?, strings with the same characters, or pairs or
+    vectors whose elements are equal?.  Pending comparisons are kept on a list
+    rather than the Python stack, so lists of any length and depth can be
+    compared.
+
+    >>> long = scheme_list(*range(5000))
+    >>> scheme_equalp(long, scheme_list(*range(5000)))
+    True
+    >>> scheme_equalp(scheme_list(1, 2), scheme_list(1, 2.0))
+    False
+    >>> scheme_equalp(Vector([1, scheme_list(2)]), Vector([1, scheme_list(2)]))
+    True
+    """
+    pending = [(x, y)]
+    while pending:
+        x, y = pending.pop()
+        while isinstance(x, Pair) and isinstance(y, Pair) and x is not y:
+            if x.known_unequal(y):
+                return False
+            pending.append((x.first, y.first))
+            x, y = x.second, y.second
+        if type(x) is Vector and type(y) is Vector and len(x) == len(y):
+            pending.extend(zip(x, y))
+        elif not (scheme_eqvp(x, y) or
+                scheme_stringp(x) and scheme_stringp(y) and x == y):
+            return False
+    return True
 
 @primitive("pair?")
 def scheme_pairp(x):
@@ -89,11 +196,7 @@ def scheme_nullp(x):
 @primitive("list?")
 def scheme_listp(x):
     """Return whether x is a well-formed list. Assumes no cycles."""
-    while x is not nil:
-        if not isinstance(x, Pair):
-            return False
-        x = x.second
-    return True
+    return x is nil or isinstance(x, Pair) and x.well_formed()
 
 @primitive("length")
 def scheme_length(x):
@@ -133,22 +236,21 @@ def scheme_append(*vals):
         v = vals[i]
         if v is not nil:
             check_type(v, scheme_pairp, i, "append")
-            r = p = Pair(v.first, result)
-            v = v.second
+            elements = []
             while scheme_pairp(v):
-                p.second = Pair(v.first, result)
-                p = p.second
+                elements.append(v.first)
                 v = v.second
-            result = r
+            for element in reversed(elements):
+                result = Pair(element, result)
     return result
 
 @primitive("string?")
 def scheme_stringp(x):
-    return isinstance(x, str) and x.startswith('"')
+    return type(x) is String
 
 @primitive("symbol?")
 def scheme_symbolp(x):
-    return isinstance(x, str) and not scheme_stringp(x)
+    return type(x) is Symbol
 
 @primitive("number?")
 def scheme_numberp(x):
@@ -156,14 +258,29 @@ def scheme_numberp(x):
 
 @primitive("integer?")
 def scheme_integerp(x):
-    return isinstance(x, int) or (scheme_numberp(x) and round(x) == x)
+    return isinstance(x, int) or isinstance(x, float) and x.is_integer()
+
+# The types of numbers whose arithmetic the fast paths below perform directly.
+# Booleans are ints in Python, so they take the general path.
+_NUMBERS = frozenset([int, float])
 
 def _check_nums(*vals):
     """Check that all arguments in VALS are numbers."""
-    for i, v in enumerate(vals):
-        if not scheme_numberp(v):
+    for v in vals:
+        if type(v) not in _NUMBERS and not scheme_numberp(v):
             msg = "operand {0} ({1}) is not a number"
-            raise SchemeError(msg.format(i, v))
+            raise SchemeError(msg.format(vals.index(v), v))
+
+def _number(s):
+    """Return the number S, with an integral float converted to an int if
+    every integer of its magnitude is exactly representable as a float.
+
+    >>> _number(3.0), _number(1e300)
+    (3, 1e+300)
+    """
+    if type(s) is float and s.is_integer() and abs(s) < 2 ** 53:
+        return int(s)
+    return s
 
 def _arith(fn, init, vals):
     """Perform the fn fneration on the number values of VALS, with INIT as
@@ -172,33 +289,61 @@ def _arith(fn, init, vals):
     s = init
     for val in vals:
         s = fn(s, val)
-    if round(s) == s:
-        s = round(s)
-    return s
+    return _number(s)
 
 @primitive("+")
 def scheme_add(*vals):
+    if len(vals) == 2:
+        x, y = vals
+        if type(x) is int and type(y) is int:
+            return x + y
+        if type(x) in _NUMBERS and type(y) in _NUMBERS:
+            return _number(x + y)
     return _arith(operator.add, 0, vals)
 
 @primitive("-")
 def scheme_sub(val0, *vals):
+    if len(vals) == 1:
+        y = vals[0]
+        if type(val0) is int and type(y) is int:
+            return val0 - y
+        if type(val0) in _NUMBERS and type(y) in _NUMBERS:
+            return _number(val0 - y)
+    _check_nums(val0)
     if len(vals) == 0:
         return -val0
     return _arith(operator.sub, val0, vals)
 
 @primitive("*")
 def scheme_mul(*vals):
+    if len(vals) == 2:
+        x, y = vals
+        if type(x) is int and type(y) is int:
+            return x * y
+        if type(x) in _NUMBERS and type(y) in _NUMBERS:
+            return _number(x * y)
     return _arith(operator.mul, 1, vals)
 
 @primitive("/")
 def scheme_div(val0, val1):
+    """Divide VAL0 by VAL1, exactly if both are integers and VAL1 divides VAL0.
+
+    >>> scheme_div(10**30, 10**15), scheme_div(5, 2)
+    (1000000000000000, 2.5)
+    """
+    _check_nums(val0, val1)
     try:
-        return _arith(operator.truediv, val0, [val1])
-    except ZeroDivisionError as err:
+        if type(val0) is int and type(val1) is int:
+            quotient, remainder = divmod(val0, val1)
+            if remainder == 0:
+                return quotient
+        return _number(val0 / val1)
+    except (ZeroDivisionError, OverflowError) as err:
         raise SchemeError(err)
 
 @primitive("quotient")
 def scheme_quo(val0, val1):
+    _check_nums(val0)
     try:
         return _arith(operator.floordiv, val0, [val1])
     except ZeroDivisionError as err:
@@ -206,6 +351,7 @@ def scheme_quo(val0, val1):
 
 @primitive("modulo", "remainder")
 def scheme_modulo(val0, val1):
+    _check_nums(val0)
     try:
         return _arith(operator.mod, val0, [val1])
     except ZeroDivisionError as err:
@@ -227,22 +373,32 @@ def _numcomp(op, x, y):
 
 @primitive("=")
 def scheme_eq(x, y):
+    if type(x) in _NUMBERS and type(y) in _NUMBERS:
+        return x == y
     return _numcomp(operator.eq, x, y)
 
 @primitive("<")
 def scheme_lt(x, y):
+    if type(x) in _NUMBERS and type(y) in _NUMBERS:
+        return x < y
     return _numcomp(operator.lt, x, y)
 
 @primitive(">")
 def scheme_gt(x, y):
+    if type(x) in _NUMBERS and type(y) in _NUMBERS:
+        return x > y
     return _numcomp(operator.gt, x, y)
 
 @primitive("<=")
 def scheme_le(x, y):
+    if type(x) in _NUMBERS and type(y) in _NUMBERS:
+        return x <= y
     return _numcomp(operator.le, x, y)
 
 @primitive(">=")
 def scheme_ge(x, y):
+    if type(x) in _NUMBERS and type(y) in _NUMBERS:
+        return x >= y
     return _numcomp(operator.ge, x, y)
 
 @primitive("even?")
@@ -303,6 +459,250 @@ def scheme_error(msg = None):
 def scheme_exit():
     raise EOFError
 
+@primitive("runtime-stats")
+def scheme_runtime_stats():
+    """An association list of the evaluator counters, such as (frames . 12)."""
+    return scheme_list(*(Pair(Symbol(name.replace("_", "-")),
+                              getattr(stats, name))
+                         for name in stats.__slots__))
+
+@primitive("recursion-depth")
+def scheme_recursion_depth():
+    """The deepest continuation stack reached by the explicit-stack evaluator,
+    counting one frame per pending subexpression."""
+    return stats.peak_stack
+
+@primitive("reset-stats")
+def scheme_reset_stats():
+    stats.reset()
+    return okay
+
+##
+## Higher-order list operations
+##
+
+def _caller(procedure, env):
+    """Return a function that applies PROCEDURE to a Python list of arguments
+    in environment ENV.  Compound procedures are applied by the analyzing
+    evaluator in scheme.py, which imports this module."""
+    if type(procedure) is PrimitiveProcedure:
+        return lambda args: procedure.apply(args, env)
+    from scheme import analyzed_apply
+    return lambda args: analyzed_apply(procedure, args, env)
+
+def _elements(s, k, name):
+    """Return a Python list of the elements of S, argument K of NAME, which
+    must be a well-formed list."""
+    items = []
+    check_type(s, scheme_listp, k, name)
+    while s is not nil:
+        items.append(s.first)
+        s = s.second
+    return items
+
+def _arguments(s, rest, name):
+    """Yield a Python list of the elements at each position of the lists S
+    and REST, which are arguments of NAME after a procedure, until the
+    shortest list ends."""
+    columns = [_elements(t, k, name) for k, t in enumerate([s] + rest, 1)]
+    for args in zip(*columns):
+        yield list(args)
+
+@primitive("map", use_env=True)
+def scheme_map(fn, s, *rest):
+    """Apply FN to the elements of the lists S and REST at each position,
+    up to the length of the shortest, returning the list of values.
+
+    >>> times = PrimitiveProcedure(lambda x, y: x * y)
+    >>> print(scheme_map(times, scheme_list(1, 2, 3), scheme_list(4, 5), None))
+    (4 10)
+    >>> scheme_map(times, scheme_list(*range(5000)), scheme_list(*range(5000)),
+    ...            None)[4999]
+    24990001
+    """
+    *rest, env = rest
+    call = _caller(fn, env)
+    return pairs([call(args) for args in _arguments(s, rest, "map")], nil)
+
+@primitive("for-each", use_env=True)
+def scheme_for_each(fn, s, *rest):
+    *rest, env = rest
+    call = _caller(fn, env)
+    for args in _arguments(s, rest, "for-each"):
+        call(args)
+    return okay
+
+@primitive("filter", use_env=True)
+def scheme_filter(pred, s, env):
+    call = _caller(pred, env)
+    return pairs([x for x in _elements(s, 1, "filter")
+                  if scheme_true(call([x]))], nil)
+
+@primitive("reduce", use_env=True)
+def scheme_reduce(fn, initial, s, env):
+    """Combine the elements of S from left to right with FN, which is called
+    as (FN element accumulated), returning INITIAL if S is empty."""
+    items = _elements(s, 2, "reduce")
+    if not items:
+        return initial
+    call, value = _caller(fn, env), items[0]
+    for x in items[1:]:
+        value = call([x, value])
+    return value
+
+class _SortKey:
+    """A sort key that orders values by calling a Scheme less-than procedure,
+    so that Python's stable merge sort can sort Scheme lists."""
+    __slots__ = ("value", "less")
+
+    def __init__(self, value, less):
+        self.value = value
+        self.less = less
+
+    def __lt__(self, other):
+        return scheme_true(self.less([self.value, other.value]))
+
+@primitive("list-sort", use_env=True)
+def scheme_list_sort(less, s, env):
+    """Return the elements of S, sorted stably by the less-than procedure
+    LESS.
+
+    >>> less = PrimitiveProcedure(lambda x, y: x.first < y.first)
+    >>> s = scheme_list(Pair(2, 'a'), Pair(1, 'b'), Pair(2, 'c'))
+    >>> print(scheme_list_sort(less, s, None))
+    ((1 . b) (2 . a) (2 . c))
+    """
+    call = _caller(less, env)
+    keys = [_SortKey(x, call) for x in _elements(s, 1, "list-sort")]
+    return pairs([key.value for key in sorted(keys)], nil)
+
+@primitive("list-tail")
+def scheme_list_tail(s, k):
+    check_type(k, _natural, 1, "list-tail")
+    for _ in range(k):
+        check_type(s, scheme_pairp, 0, "list-tail")
+        s = s.second
+    return s
+
+##
+## Vectors and hash tables
+##
+
+@primitive("vector?")
+def scheme_vectorp(x):
+    return type(x) is Vector
+
+@primitive("make-vector")
+def scheme_make_vector(k, fill=False):
+    check_type(k, _natural, 0, "make-vector")
+    return Vector([fill] * k)
+
+@primitive("vector")
+def scheme_vector(*vals):
+    return Vector(vals)
+
+@primitive("vector-length")
+def scheme_vector_length(v):
+    check_type(v, scheme_vectorp, 0, "vector-length")
+    return len(v)
+
+def _vector_index(v, k, name):
+    """Check that V is a vector and K is an index into it."""
+    check_type(v, scheme_vectorp, 0, name)
+    check_type(k, _natural, 1, name)
+    if k >= len(v):
+        raise SchemeError("{0}: index {1} out of range".format(name, k))
+
+@primitive("vector-ref")
+def scheme_vector_ref(v, k):
+    _vector_index(v, k, "vector-ref")
+    return v[k]
+
+@primitive("vector-set!")
+def scheme_vector_set(v, k, x):
+    _vector_index(v, k, "vector-set!")
+    v[k] = x
+    return okay
+
+@primitive("list->vector")
+def scheme_list_to_vector(s):
+    check_type(s, scheme_listp, 0, "list->vector")
+    return Vector(s[k] for k in range(len(s)))
+
+@primitive("vector->list")
+def scheme_vector_to_list(v):
+    check_type(v, scheme_vectorp, 0, "vector->list")
+    return scheme_list(*v)
+
+def _natural(x):
+    """Whether X is a non-negative exact integer."""
+    return type(x) is int and x >= 0
+
+@primitive("hash-table?")
+def scheme_hash_tablep(x):
+    return type(x) is HashTable
+
+@primitive("make-hash-table")
+def scheme_make_hash_table():
+    return HashTable()
+
+def _hash_key(table, key, name):
+    """Check that TABLE is a hash table and return the equal_key under which
+    it stores KEY."""
+    check_type(table, scheme_hash_tablep, 0, name)
+    stored = equal_key(key)
+    try:
+        hash(stored)
+    except TypeError:
+        raise SchemeError("{0}: {1} cannot be a key".format(name, key))
+    return stored
+
+# The default of hash-ref when none is given
+_NO_DEFAULT = object()
+
+@primitive("hash-ref")
+def scheme_hash_ref(table, key, default=_NO_DEFAULT):
+    stored = _hash_key(table, key, "hash-ref")
+    if stored in table:
+        return table[stored]
+    if default is not _NO_DEFAULT:
+        return default
+    raise SchemeError("hash-ref: no value for key {0}".format(key))
+
+@primitive("hash-set!")
+def scheme_hash_set(table, key, value):
+    table[_hash_key(table, key, "hash-set!")] = value
+    return okay
+
+@primitive("hash-count")
+def scheme_hash_count(table):
+    check_type(table, scheme_hash_tablep, 0, "hash-count")
+    return len(table)
+
+##
+## Promises and streams
+##
+
+@primitive("promise?")
+def scheme_promisep(x):
+    return type(x) is Promise
+
+@primitive("force")
+def scheme_force(x):
+    if type(x) is Promise:
+        return x.force()
+    return x
+
+@primitive("stream-car")
+def scheme_stream_car(x):
+    check_type(x, scheme_pairp, 0, 'stream-car')
+    return x.first
+
+@primitive("stream-cdr")
+def scheme_stream_cdr(x):
+    check_type(x, scheme_pairp, 0, 'stream-cdr')
+    return scheme_force(x.second)
+
 ##
 ## Turtle graphics (non-standard)
 ##
@@ -0,0 +1,129 @@
+"""This module implements a profiler for Scheme procedures.
+
+A Profiler wraps the analyzed body of each compound procedure so that every
+application records its call count and time.  Procedures are identified by
+their analyzed body, so all closures created by one lambda expression are
+profiled together.  A tail call ends the application that makes it, just as
+it ends that procedure's frame.
+
+The profiler is installed only by the -profile flag of scheme.py, so that
+evaluation without it is unaffected.  It requires the default -analyze
+backend; combining -profile with another backend is an error.
+
+Usage: python3 scheme.py -profile [FILE]
+"""
+
+import time
+
+class Profiler:
+    """A Profiler records, for each procedure, its number of calls, its
+    inclusive and exclusive time in seconds, and its deepest recursion.  It
+    also records the exclusive time of each distinct stack of procedures, for
+    a collapsed-stack file.
+
+    >>> profiler = Profiler()
+    >>> def analyze(procedure, parent):
+    ...     procedure.analyzed = lambda env: env * 2
+    >>> class Procedure:
+    ...     pass
+    >>> procedure = Procedure()
+    >>> profiler.wrap(analyze, repr)(procedure, None)
+    >>> procedure.analyzed(21), procedure.analyzed(1)
+    (42, 2)
+    >>> profiler.stats[procedure.analyzed][0]
+    2
+    """
+
+    # Procedures are keyed by their profiled executors
+    def __init__(self):
+        self.stats = {}   # key -> [calls, inclusive, exclusive, max depth]
+        self.labels = {}  # key -> label used when it has no name
+        self.active = {}  # key -> number of applications in progress
+        self.root = [0.0, {}]  # A node is [exclusive time, children by key]
+        self.stack = []   # [node, start, time in callees] per application
+        self.max_depth = 0
+
+    def wrap(self, analyze, label):
+        """Return a replacement for the function ANALYZE, which analyzes the
+        body of a procedure, that also profiles the procedure.  LABEL returns
+        a label for a procedure that is not named in the report."""
+        def analyze_profiled(procedure, parent):
+            analyze(procedure, parent)
+            procedure.analyzed = self.profiled(procedure.analyzed,
+                                               label(procedure))
+        return analyze_profiled
+
+    def profiled(self, executor, label):
+        """Return an executor that profiles each application of EXECUTOR, the
+        analyzed body of a procedure with LABEL."""
+        stats, active, stack = [0, 0.0, 0.0, 0], self.active, self.stack
+        def execute(env):
+            parent = stack[-1][0] if stack else self.root
+            node = parent[1].get(execute)
+            if node is None:
+                node = parent[1][execute] = [0.0, {}]
+            depth = active[execute] = active[execute] + 1
+            stats[0] += 1
+            if depth > stats[3]:
+                stats[3] = depth
+            if len(stack) >= self.max_depth:
+                self.max_depth = len(stack) + 1
+            frame = [node, time.perf_counter(), 0.0]
+            stack.append(frame)
+            try:
+                return executor(env)
+            finally:
+                elapsed = time.perf_counter() - frame[1]
+                stack.pop()
+                active[execute] -= 1
+                exclusive = elapsed - frame[2]
+                if not active[execute]:
+                    stats[1] += elapsed
+                stats[2] += exclusive
+                node[0] += exclusive
+                if stack:
+                    stack[-1][2] += elapsed
+        self.stats[execute], self.labels[execute] = stats, label
+        active[execute] = 0
+        return execute
+
+    def report(self, names):
+        """Return the text of a report on each procedure, named by the dict
+        NAMES from analyzed bodies to names, with the most exclusive time
+        first."""
+        lines = ["{0:>10} {1:>12} {2:>12} {3:>9}  {4}".format(
+            "calls", "inclusive", "exclusive", "depth", "procedure")]
+        order = sorted(self.stats.items(), key=lambda item: -item[1][2])
+        for key, (calls, inclusive, exclusive, depth) in order:
+            if calls:
+                lines.append("{0:>10} {1:>12.6f} {2:>12.6f} {3:>9}  {4}".format(
+                    calls, inclusive, exclusive, depth, self.name(key, names)))
+        lines.append("maximum depth of procedure calls: {0}".format(
+            self.max_depth))
+        return "\n".join(lines) + "\n"
+
+    def collapsed(self, names):
+        """Return the collapsed stacks of procedures, one per line with its
+        exclusive time in microseconds, as read by flame graph tools."""
+        lines = []
+        pending = [((), self.root)]
+        while pending:
+            path, node = pending.pop()
+            micros = round(node[0] * 1e6)
+            if path and micros:
+                lines.append("{0} {1}".format(";".join(path), micros))
+            for key, child in node[1].items():
+                pending.append((path + (self.name(key, names),), child))
+        return "\n".join(sorted(lines)) + "\n"
+
+    def name(self, key, names):
+        """The name of the procedure with KEY in a report."""
+        return (names.get(key) or self.labels[key]).replace(";", ":")
+
+    def write(self, prefix, names):
+        """Write the report to PREFIX.profile and the collapsed stacks to
+        PREFIX.folded."""
+        with open(prefix + ".profile", "w") as f:
+            f.write(self.report(names))
+        with open(prefix + ".folded", "w") as f:
+            f.write(self.collapsed(names))
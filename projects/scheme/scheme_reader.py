@@ -4,8 +4,12 @@ with a parser for Scheme expressions.
 In addition to the types defined in this file, some data types in Scheme are
 represented by their corresponding type in Python:
     number:       int or float
-    symbol:       string
+    symbol:       Symbol (an interned subclass of str)
+    string:       String (a subclass of str)
     boolean:      bool
+    vector:       Vector (a subclass of list)
+    hash table:   HashTable (a subclass of dict)
+    promise:      Promise
     unspecified:  None
 
 The __repr__ method of a Scheme value will return a Python expression that
@@ -16,16 +20,60 @@ would be read to the value, where possible.
 """
 
 from ucb import main, trace, interact
-from scheme_tokens import tokenize_lines, DELIMITERS
+from scheme_tokens import tokenize_lines, DELIMITERS, Symbol, String
 from buffer import Buffer, InputReader, LineReader
 
 # Pairs and Scheme lists
 
+# The number of times that any pair has been changed after its construction.
+# Metadata cached on a pair is valid only if it was computed since then.
+mutations = 0
+
+class RuntimeStats:
+    """Counters of the work done by the evaluators: the calls evaluated
+    (steps), the applications of compound procedures, the frames and pairs
+    created, the tail calls taken without growing the Python stack, the
+    peak depth of nested local frames, and the peak depth of the
+    continuation stack of the explicit-stack evaluator in scheme_cek.
+
+    >>> stats.reset()
+    >>> s = Pair(1, Pair(2, nil))
+    >>> stats.pairs
+    2
+    """
+    __slots__ = ("steps", "applications", "frames", "pairs", "tail_calls",
+                 "peak_depth", "peak_stack")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Set every counter to zero."""
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+# The counters of the running interpreter, reported by runtime-stats
+stats = RuntimeStats()
+
 class Pair:
     """A pair has two instance attributes: first and second.  For a Pair to be
     a well-formed list, second is either a well-formed list or nil.  Some
     methods only apply to well-formed lists.
 
+    Each pair caches the length of the list that it begins, so that len and
+    well_formed take constant time, and indexing caches the elements of the
+    list.  The cached method memoizes other functions of a pair, such as
+    syntax checks.  Assigning to first or second invalidates all cached
+    metadata.
+
+    Pairs that are equal, because their elements are equal, have equal
+    hashes, so a pair may be used as a dict key while it is not mutated.
+
+    A pair read from source that tracks token columns has a span attribute,
+    (first line, first column, last line, last column), giving the positions
+    of the first and last tokens of the list that it begins.  Other pairs
+    have no span.
+
     >>> s = Pair(1, Pair(2, nil))
     >>> s
     Pair(1, Pair(2, nil))
@@ -37,10 +85,84 @@ class Pair:
     2
     >>> print(s.map(lambda x: x+4))
     (5 6)
+    >>> t = Pair(0, s)
+    >>> s.second = Pair(3, 4)
+    >>> t.well_formed(), s[1]
+    (False, 3)
     """
+    __slots__ = ("first", "second", "_length", "_version", "_cache", "span")
+
     def __init__(self, first, second):
-        self.first = first
-        self.second = second
+        stats.pairs += 1
+        _set_first(self, first)
+        _set_second(self, second)
+        if second is nil:
+            _set_length(self, 1)
+        elif isinstance(second, Pair) and second._version == mutations:
+            length = second._length
+            _set_length(self, None if length is None else length + 1)
+        elif isinstance(second, Pair):
+            return  # Computed on demand by _list_length
+        else:
+            _set_length(self, None)
+        _set_version(self, mutations)
+
+    def __setattr__(self, name, value):
+        global mutations
+        mutations += 1
+        object.__setattr__(self, name, value)
+
+    def _list_length(self):
+        """Return the length of the list that begins with SELF, or None if
+        SELF is not a well-formed list."""
+        if getattr(self, "_version", -1) == mutations:
+            return self._length
+        pairs, p = [], self
+        while isinstance(p, Pair):
+            if getattr(p, "_version", -1) == mutations:
+                break
+            pairs.append(p)
+            p = p.second
+        if p is nil:
+            length = 0
+        elif isinstance(p, Pair):
+            length = p._length
+        else:
+            length = None
+        for p in reversed(pairs):
+            if length is not None:
+                length += 1
+            _set_length(p, length)
+            _set_version(p, mutations)
+        return length
+
+    def cached(self, key, fn):
+        """Return FN(SELF), calling FN at most once for each KEY until a pair
+        is mutated."""
+        version, cache = getattr(self, "_cache", (None, None))
+        if version != mutations:
+            cache = {}
+            _set_cache(self, (mutations, cache))
+        if key not in cache:
+            cache[key] = fn(self)
+        return cache[key]
+
+    def known_unequal(self, p):
+        """Return whether the lengths or hashes cached on SELF and the pair P
+        show that they are not equal, without traversing either of them."""
+        if (getattr(self, "_version", -1) == mutations ==
+                getattr(p, "_version", -1) and self._length != p._length):
+            return True
+        mine = getattr(self, "_cache", (None, {}))
+        theirs = getattr(p, "_cache", (None, {}))
+        if (mine[0] == mutations == theirs[0] and "hash" in mine[1]
+                and "hash" in theirs[1]):
+            return mine[1]["hash"] != theirs[1]["hash"]
+        return False
+
+    def well_formed(self):
+        """Return whether SELF is a well-formed list."""
+        return self._list_length() is not None
 
     def __repr__(self):
         return "Pair({0}, {1})".format(repr(self.first), repr(self.second))
@@ -56,30 +178,35 @@ class Pair:
         return s + ")"
 
     def __len__(self):
-        n, second = 1, self.second
-        while isinstance(second, Pair):
-            n += 1
-            second = second.second
-        if second is not nil:
+        n = self._list_length()
+        if n is None:
             raise TypeError("length attempted on improper list")
         return n
 
     def __getitem__(self, k):
         if k < 0:
             raise IndexError("negative index into list")
-        y = self
-        for _ in range(k):
-            if y.second is nil:
-                raise IndexError("list index out of bounds")
-            elif not isinstance(y.second, Pair):
-                raise TypeError("ill-formed list")
-            y = y.second
-        return y.first
+        if k == 0:
+            return self.first
+        if self._list_length() is None:
+            y = self
+            for _ in range(k):
+                if y.second is nil:
+                    raise IndexError("list index out of bounds")
+                elif not isinstance(y.second, Pair):
+                    raise TypeError("ill-formed list")
+                y = y.second
+            return y.first
+        items = self.cached("items", list_elements)
+        if k >= len(items):
+            raise IndexError("list index out of bounds")
+        return items[k]
 
     def __eq__(self, p):
-        if not isinstance(p, Pair):
-            return False
-        return self.first == p.first and self.second == p.second
+        return structures_equal(self, p, False)
+
+    def __hash__(self):
+        return self.cached("hash", pair_hash)
 
     def map(self, fn):
         """Return a Scheme list after mapping Python function FN to SELF."""
@@ -89,6 +216,136 @@ class Pair:
         else:
             raise TypeError("ill-formed list")
 
+    def __reduce__(self):
+        # Pickle a list as its elements, rather than as nested pairs
+        items, s = [], self
+        while isinstance(s, Pair):
+            items.append(s.first)
+            s = s.second
+        return (pairs, (items, s))
+
+def pairs(items, tail):
+    """Return the pairs of the Python list ITEMS, followed by TAIL.
+
+    >>> pairs([1, 2], 3)
+    Pair(1, Pair(2, 3))
+    """
+    for item in reversed(items):
+        tail = Pair(item, tail)
+    return tail
+
+def structures_equal(x, y, strict):
+    """Whether X and Y are equal, with pairs compared by their elements and
+    other values by ==.  If STRICT is true, values of different types, such
+    as 1, 1.0 and #t, are never equal, as in equal?.  Pending comparisons are
+    kept on a list rather than the Python stack, so pairs nested to any depth
+    can be compared.
+
+    >>> structures_equal(read_line("(1 (a))"), pairs([1.0, Pair("a", nil)],
+    ...                  nil), False)
+    True
+    >>> structures_equal(read_line("(1 (a))"), read_line("(1.0 (a))"), True)
+    False
+    """
+    pending = [(x, y)]
+    while pending:
+        x, y = pending.pop()
+        while isinstance(x, Pair) and isinstance(y, Pair) and x is not y:
+            if x.known_unequal(y):
+                return False
+            pending.append((x.first, y.first))
+            x, y = x.second, y.second
+        if x is y:
+            continue
+        if (isinstance(x, Pair) or isinstance(y, Pair) or
+                strict and type(x) is not type(y) or not x == y):
+            return False
+    return True
+
+def pair_hash(s):
+    """Return a hash of the structure of the pair S, consistent with ==, that
+    follows both elements of each pair in a loop rather than recursively.
+
+    >>> hash(read_line("(1 (2 . 3))")) == hash(read_line("(1 (2 . 3))"))
+    True
+    >>> def nest(depth):
+    ...     s = nil
+    ...     for _ in range(depth):
+    ...         s = Pair(s, nil)
+    ...     return s
+    >>> hash(nest(3000)) == hash(nest(3000)), nest(3000) == nest(3000)
+    (True, True)
+    """
+    return structure_hash(s, lambda x: x)
+
+def structure_hash(s, key):
+    """Return a hash of the pair S computed from the KEY of each value in it
+    that is not a pair."""
+    # Each pair is written as Pair followed by its elements, in preorder
+    tokens, pending = [], [s]
+    while pending:
+        x = pending.pop()
+        if isinstance(x, Pair):
+            tokens.append(Pair)
+            pending.append(x.second)
+            pending.append(x.first)
+        else:
+            tokens.append(key(x))
+    return hash(tuple(tokens))
+
+class EqualKey:
+    """The equal_key of a pair, which is equal to another EqualKey exactly
+    when their pairs are equal?."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return (type(other) is EqualKey and
+                structures_equal(self.value, other.value, True))
+
+    def __hash__(self):
+        return self.value.cached("equal hash",
+                                 lambda s: structure_hash(s, equal_key))
+
+def equal_key(x):
+    """Return a key for X that is equal to the key of Y, and has the same
+    hash, exactly when X and Y are equal? values that cannot be mutated in
+    place.  Atoms are tagged with their types, so that 1, 1.0 and #t, which
+    Python considers equal, have different keys.  A vector has no key, and
+    hashing it raises TypeError.
+
+    >>> equal_key(1) == equal_key(True), equal_key(1) == equal_key(1.0)
+    (False, False)
+    >>> equal_key(read_line("(1 2)")) == equal_key(read_line("(1 2)"))
+    True
+    >>> equal_key(read_line("(1 2)")) == equal_key(read_line("(#t 2)"))
+    False
+    """
+    if type(x) in (int, float, bool, Symbol, String):
+        return (type(x), x)
+    elif isinstance(x, Pair):
+        return EqualKey(x)
+    return x
+
+def list_elements(s):
+    """Return a Python list of the elements of the well-formed list S."""
+    items = []
+    while s is not nil:
+        items.append(s.first)
+        s = s.second
+    return items
+
+# Slot setters that bypass Pair.__setattr__, which counts mutations
+_set_first = Pair.first.__set__
+_set_second = Pair.second.__set__
+_set_length = Pair._length.__set__
+_set_version = Pair._version.__set__
+_set_cache = Pair._cache.__set__
+_set_span = Pair.span.__set__
+
 class nil:
     """The empty list"""
 
@@ -109,10 +366,98 @@ class nil:
     def map(self, fn):
         return self
 
+    def __reduce__(self):
+        return "nil"
+
 nil = nil() # Assignment hides the nil class; there is only one instance
 
+# Vectors and hash tables
+
+class Vector(list):
+    """A Scheme vector, a mutable sequence of values indexed from 0.
+
+    >>> v = Vector([1, Pair(2, nil)])
+    >>> v
+    Vector([1, Pair(2, nil)])
+    >>> print(v)
+    #(1 (2))
+    """
+
+    def __repr__(self):
+        return "Vector({0})".format(list.__repr__(self))
+
+    def __str__(self):
+        return "#(" + " ".join(str(item) for item in self) + ")"
+
+class HashTable(dict):
+    """A Scheme hash table, which maps the equal_key of each Scheme key to
+    its value, so that keys are compared with equal?.
+
+    >>> table = HashTable()
+    >>> table[equal_key(read_line("(1 2)"))] = 3
+    >>> table[equal_key(Pair(1, Pair(2, nil)))]
+    3
+    >>> equal_key(Pair(True, Pair(2, nil))) in table
+    False
+    """
+
+    def __repr__(self):
+        return "HashTable({0})".format(dict.__repr__(self))
+
+    def __str__(self):
+        return "#[hash-table]"
+
+# Promises
+
+class Promise:
+    """A promise computes its value by calling COMPUTE, a function of no
+    arguments, the first time that it is forced, and remembers the value.
+
+    If CHAINED is true, as for a promise made by delay-force, COMPUTE returns
+    another promise, whose value becomes the value of this one.  A chain of
+    such promises is forced in a loop, so its length is not limited by the
+    Python stack.
+
+    >>> p = Promise(lambda: Promise(lambda: 3), True)
+    >>> print(p)
+    #[promise (not forced)]
+    >>> p.force(), str(p)
+    (3, '#[promise (forced)]')
+    """
+    __slots__ = ("compute", "chained", "value")
+
+    def __init__(self, compute, chained=False):
+        self.compute = compute
+        self.chained = chained
+        self.value = None
+
+    def force(self):
+        """Return the value of SELF, computing it if it has not been forced."""
+        promise, waiting = self, []
+        while promise.compute is not None:
+            value = promise.compute()
+            if promise.compute is None:
+                break  # Forced while it was being computed
+            if promise.chained and isinstance(value, Promise):
+                waiting.append(promise)
+                promise = value
+            else:
+                promise.value, promise.compute = value, None
+        for p in waiting:
+            p.value, p.compute, p.chained = promise.value, None, False
+        return promise.value
+
+    def __repr__(self):
+        return "Promise({0})".format(
+            "..." if self.compute is not None else repr(self.value))
+
+    def __str__(self):
+        forced = "not forced" if self.compute is not None else "forced"
+        return "#[promise ({0})]".format(forced)
+
 # Scheme list parser
 
+QUOTE = Symbol('quote')
 
 def scheme_read(src):
     """Read the next expression from SRC, a Buffer of tokens.
@@ -128,17 +473,7 @@ def scheme_read(src):
     """
     if src.current() is None:
         raise EOFError
-    val = src.pop()
-    if val == "nil":
-        return nil
-    elif val not in DELIMITERS:
-        return val
-    elif val == "'":
-        return Pair('quote',Pair(scheme_read(src),nil))
-    elif val == "(":
-        return read_tail(src)
-    else:
-        raise SyntaxError("unexpected token: {0}".format(val))
+    return read_expression(src, False)
 
 def read_tail(src):
     """Return the remainder of a list in SRC, starting before an element or ).
@@ -160,25 +495,109 @@ def read_tail(src):
     >>> scheme_read(Buffer(tokenize_lines(["(1", "2 .", "'(3 4))", "4"])))
     Pair(1, Pair(2, Pair('quote', Pair(Pair(3, Pair(4, nil)), nil))))
     """
+    return read_expression(src, True)
+
+def read_expression(src, in_list):
+    """Read an expression from SRC, or the remainder of a list if IN_LIST.
+
+    Nested lists and quotations are kept on an explicit stack rather than the
+    Python stack, so the depth of an expression is limited only by memory.
+    If SRC tracks the columns of its tokens, each pair that is read records
+    the span of source that it was read from.
+
+    >>> columns = []
+    >>> src = Buffer(tokenize_lines(["(define (f x)", "  '(x . 2))"], columns), columns)
+    >>> expr = scheme_read(src)
+    >>> expr.span, expr.second.first.span, expr.second.second.first.span
+    ((1, 0, 2, 10), (1, 8, 1, 12), (2, 2, 2, 9))
+    >>> hasattr(read_line("(1 2 3)"), "span")
+    False
+    """
+    track = src.columns is not None
+    # Each frame on the stack is either a list frame, [elements, starts of
+    # the elements, start of the list, whether a dot has been read], or a
+    # quotation frame, (QUOTE, start of the quotation).
+    stack = [[[], [], None, False]] if in_list else []
+    lists = len(stack)
+    start = end = None
     try:
-        if src.current() is None:
-            raise SyntaxError("unexpected end of file")
-        if src.current() == ")":
-            src.pop()
-            return nil
-        if src.current()=='.':
-            src.pop()
-            second = scheme_read(src)
-            if src.current() == ')':
-                src.pop()       #Pop trailing ')'
-                return second   #Complete the pair
+        while True:
+            frame = stack[-1] if stack else None
+            elements = type(frame) is list and not frame[3]
+            token = src.current()
+            if elements and token == ")":
+                if track:
+                    end = src.position()
+                src.pop()
+                stack.pop()
+                lists -= 1
+                value, start = build_list(frame, nil, end, track), frame[2]
+            elif elements and token == ".":
+                src.pop()
+                frame[3] = True
+                continue
             else:
-                raise SyntaxError("Expected one element after .")
-        first = scheme_read(src)
-        rest = read_tail(src)
-        return Pair(first, rest)
+                if token is None:
+                    if lists:
+                        raise SyntaxError("unexpected end of file")
+                    raise EOFError
+                if track:
+                    start = end = src.position()
+                src.pop()
+                if token == "nil":
+                    value = nil
+                elif token not in DELIMITERS:
+                    value = token
+                elif token == "'":
+                    stack.append((QUOTE, start))
+                    continue
+                elif token == "(":
+                    stack.append([[], [], start, False])
+                    lists += 1
+                    continue
+                else:
+                    raise SyntaxError("unexpected token: {0}".format(token))
+
+            # Return VALUE, which spans from START to END, to the enclosing frames
+            while True:
+                if not stack:
+                    return value
+                frame = stack[-1]
+                if type(frame) is tuple:
+                    stack.pop()
+                    value = Pair(QUOTE, Pair(value, nil))
+                    if track:
+                        start = frame[1]
+                        _set_span(value, start + end)
+                elif frame[3]:
+                    if src.current() != ")":
+                        raise SyntaxError("Expected one element after .")
+                    if track:
+                        end = src.position()
+                    src.pop()
+                    stack.pop()
+                    lists -= 1
+                    value, start = build_list(frame, value, end, track), frame[2]
+                else:
+                    frame[0].append(value)
+                    if track:
+                        frame[1].append(start)
+                    break
     except EOFError:
-        raise SyntaxError("unexpected end of file")
+        if lists:
+            raise SyntaxError("unexpected end of file")
+        raise
+
+def build_list(frame, tail, end, track):
+    """Return the list of the elements in list FRAME followed by TAIL, with
+    the span of each pair ending at END if TRACK."""
+    elements, starts, start, _ = frame
+    s = tail
+    for i in range(len(elements) - 1, -1, -1):
+        s = Pair(elements[i], s)
+        if track:
+            _set_span(s, (start if i == 0 and start else starts[i]) + end)
+    return s
 
 # Convenience methods
 
@@ -187,7 +606,8 @@ def buffer_input(prompt="scm> "):
     return Buffer(tokenize_lines(InputReader(prompt)))
 
 def buffer_lines(lines, prompt="scm> ", show_prompt=False):
-    """Return a Buffer instance iterating through LINES."""
+    """Return a Buffer instance iterating through LINES, an iterator of lines
+    such as an open file."""
     if show_prompt:
         input_lines = lines
     else:
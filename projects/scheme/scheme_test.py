@@ -1,6 +1,6 @@
 """Unit testing framework for the Scheme interpreter.
 
-Usage: python3 scheme_test.py FILE
+Usage: python3 scheme_test.py [-stats] [FILE ...]
 
 Interprets FILE as interactive Scheme source code, and compares each line
 of printed output from the read-eval-print loop and from any output functions
@@ -10,12 +10,13 @@ to an expected output described in a comment.  For example,
 ; expect 5
 
 Differences between printed and expected outputs are printed with line numbers.
+With -stats, the counters of evaluator work are printed after each FILE.
 """
 
 import io
 import sys
 from buffer import Buffer
-from scheme import read_eval_print_loop, create_global_frame
+from scheme import read_eval_print_loop, create_global_frame, stats
 from scheme_tokens import tokenize_lines
 from ucb import main
 
@@ -67,13 +68,12 @@ class TestReader:
             yield line
         raise EOFError
 
-@main
 def run_tests(src_file='tests.scm'):
     """Run a read-eval loop that reads from src_file and collects outputs."""
     sys.stderr = sys.stdout = io.StringIO() # Collect output to stdout and stderr
     reader = None
     try:
-        reader = TestReader(open(src_file).readlines(), sys.stdout)
+        reader = TestReader(open(src_file), sys.stdout)
         src = Buffer(tokenize_lines(reader))
         def next_line():
             src.current()
@@ -90,3 +90,21 @@ def run_tests(src_file='tests.scm'):
         sys.stdout = sys.__stdout__  # Revert stdout
         sys.stderr = sys.__stderr__  # Revert stderr
     summarize(reader.output, reader.expected_output)
+
+def print_stats(src_file):
+    """Print the counters of the work done while running SRC_FILE."""
+    counts = ', '.join('{0} {1}'.format(name.replace('_', '-'),
+                                        getattr(stats, name))
+                       for name in stats.__slots__)
+    print('{0}: {1}'.format(src_file, counts))
+
+@main
+def run(*argv):
+    """Run the tests in each file in ARGV, by default tests.scm."""
+    show_stats = '-stats' in argv
+    src_files = [arg for arg in argv if arg != '-stats'] or ['tests.scm']
+    for src_file in src_files:
+        stats.reset()
+        run_tests(src_file)
+        if show_stats:
+            print_stats(src_file)
@@ -4,8 +4,10 @@ of tokens.  A token may be:
 
   * A number (represented as an int or float)
   * A boolean (represented as a bool)
-  * A symbol (represented as a string)
-  * A delimiter, including parentheses, dots, and single quotes
+  * A symbol (represented as a Symbol)
+  * A string (represented as a String)
+  * A delimiter, including parentheses, dots, and single quotes (represented
+    as a str)
 
 This file also includes some features of Scheme that have not been addressed
 in the course, such as quasiquoting and Scheme strings.
@@ -13,9 +15,39 @@ in the course, such as quasiquoting and Scheme strings.
 
 from ucb import main
 import itertools
+import re
 import string
 import sys
-import tokenize
+import weakref
+
+class Symbol(str):
+    """A Scheme symbol.  Symbols are interned: while a Symbol is in use, every
+    Symbol with the same name is that same object, so symbols can be compared
+    by identity and type-tested with a single identity check.
+
+    >>> Symbol('x') is Symbol('x')
+    True
+    >>> Symbol('x')
+    'x'
+    """
+    _interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, name):
+        try:
+            return cls._interned[name]
+        except KeyError:
+            symbol = cls._interned[name] = str.__new__(cls, name)
+            return symbol
+
+    def __reduce__(self):
+        return (Symbol, (str(self),))
+
+class String(str):
+    """A Scheme string, represented by its source text including the
+    surrounding double quotes."""
+
+    def __reduce__(self):
+        return (String, (str(self),))
 
 _NUMERAL_STARTS = set(string.digits) | set('+-.')
 _SYMBOL_CHARS = (set('!$%&*/:<=>?@^_~') | set(string.ascii_lowercase) |
@@ -26,94 +58,112 @@ _SINGLE_CHAR_TOKENS = set("()'`")
 _TOKEN_END = _WHITESPACE | _SINGLE_CHAR_TOKENS | _STRING_DELIMS | {',', ',@'}
 DELIMITERS = _SINGLE_CHAR_TOKENS | {'.', ',', ',@'}
 
+# A candidate token, after any whitespace: a comment, a delimiter, a boolean,
+# a string (no triple quotes in Scheme), an unterminated string, or an atom.
+_TOKEN = re.compile(r"""[ \t\n\r]*(;.*|[()'`]|,@?|\#(?s:.)?|
+                        "(?:[^"\\\n]|\\.)*"|".*|[^ \t\n\r()'`",]+)""",
+                    re.VERBOSE)
+_STRING = re.compile(r'"(?:[^"\\\n]|\\.)*"\Z')
+_SYMBOL = re.compile(r"[!$%&*/:<=>?@^_~a-zA-Z0-9+\-.]+\Z")
+
+# Tokens for candidate texts seen before, cleared when it grows too large
+_TOKENS = {}
+_MAX_TOKENS = 10000
+
 def valid_symbol(s):
     """Returns whether s is not a well-formed value."""
-    if len(s) == 0:
-        return False
-    for c in s:
-        if c not in _SYMBOL_CHARS:
-            return False
-    return True
-
-def next_candidate_token(line, k):
-    """A tuple (tok, k'), where tok is the next substring of line at or
-    after position k that could be a token (assuming it passes a validity
-    check), and k' is the position in line following that token.  Returns
-    (None, len(line)) when there are no more tokens."""
-    while k < len(line):
-        c = line[k]
-        if c == ';':
-            return None, len(line)
-        elif c in _WHITESPACE:
-            k += 1
-        elif c in _SINGLE_CHAR_TOKENS:
-            return c, k+1
-        elif c == '#':  # Boolean values #t and #f
-            return line[k:k+2], min(k+2, len(line))
-        elif c == ',': # Unquote; check for @
-            if k+1 < len(line) and line[k+1] == '@':
-                return ',@', k+2
-            return c, k+1
-        elif c in _STRING_DELIMS:
-            if k+1 < len(line) and line[k+1] == c: # No triple quotes in Scheme
-                return c+c, k+2
-            line_bytes = (bytes(line[k:], encoding='utf-8'),)
-            gen = tokenize.tokenize(iter(line_bytes).__next__)
-            next(gen) # Throw away encoding token
-            token = next(gen)
-            if token.type != tokenize.STRING:
-                raise ValueError("invalid string: {0}".format(token.string))
-            return token.string, token.end[1]+k
-        else:
-            j = k
-            while j < len(line) and line[j] not in _TOKEN_END:
-                j += 1
-            return line[k:j], min(j, len(line))
-    return None, len(line)
-
-def tokenize_line(line):
-    """The list of Scheme tokens on line.  Excludes comments and whitespace."""
+    return _SYMBOL.match(s) is not None
+
+def tokenize_line(line, columns=None):
+    """The list of Scheme tokens on line.  Excludes comments and whitespace.
+    If COLUMNS is a list, the column at which each token starts is appended
+    to it.
+
+    >>> columns = []
+    >>> tokenize_line("(define (f x) #t) ; comment", columns)
+    ['(', 'define', '(', 'f', 'x', ')', True, ')']
+    >>> columns
+    [0, 1, 8, 9, 11, 12, 14, 16]
+    >>> tokenize_line('`(1 -2.5 ,@x "a b")')
+    ['`', '(', 1, -2.5, ',@', 'x', '"a b"', ')']
+    """
+    if columns is None:
+        texts = _TOKEN.findall(line)
+    else:
+        matches = list(_TOKEN.finditer(line))
+        texts = [match.group(1) for match in matches]
     result = []
-    text, i = next_candidate_token(line, 0)
-    while text is not None:
-        if text in DELIMITERS:
-            result.append(text)
-        elif text == '#t' or text.lower() == 'true':
-            result.append(True)
-        elif text == '#f' or text.lower() == 'false':
-            result.append(False)
-        elif text == 'nil':
-            result.append(text)
-        elif text[0] in _SYMBOL_CHARS:
-            number = False
-            if text[0] in _NUMERAL_STARTS:
-                try:
-                    result.append(int(text))
-                    number = True
-                except ValueError:
-                    try:
-                        result.append(float(text))
-                        number = True
-                    except ValueError:
-                        pass
-            if not number:
-                if valid_symbol(text):
-                    result.append(text.lower())
-                else:
-                    raise ValueError("invalid numeral or symbol: {0}".format(text))
-        elif text[0] in _STRING_DELIMS:
-            result.append(text)
-        else:
-            print("warning: invalid token: {0}".format(text), file=sys.stderr)
-            print("    ", line, file=sys.stderr)
-            print(" " * (i+3), "^", file=sys.stderr)
-        text, i = next_candidate_token(line, i)
+    for i, text in enumerate(texts):
+        try:
+            token = _TOKENS[text]
+        except KeyError:
+            if text[0] == ';':
+                break
+            token = make_token(text)
+            if token is None:
+                invalid_token(line, text)
+                continue
+            if len(_TOKENS) >= _MAX_TOKENS:
+                _TOKENS.clear()
+            _TOKENS[text] = token
+        result.append(token)
+        if columns is not None:
+            columns.append(matches[i].start(1))
     return result
 
-def tokenize_lines(input):
+def make_token(text):
+    """Return the token for the candidate TEXT, or None if it is not one."""
+    c = text[0]
+    if text in DELIMITERS:
+        return text
+    elif c == '#':
+        if text == '#t' or text == '#f':
+            return text == '#t'
+        return None
+    elif c in _STRING_DELIMS:
+        if not _STRING.match(text):
+            raise ValueError("invalid string: {0}".format(text))
+        return String(text)
+    lower = text.lower()
+    if lower == 'true' or lower == 'false':
+        return lower == 'true'
+    elif text == 'nil':
+        return Symbol(text)
+    elif c not in _SYMBOL_CHARS:
+        return None
+    if c in _NUMERAL_STARTS:
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                pass
+    if not valid_symbol(text):
+        raise ValueError("invalid numeral or symbol: {0}".format(text))
+    return Symbol(lower)
+
+def invalid_token(line, text):
+    """Warn that TEXT on LINE is not a token."""
+    print("warning: invalid token: {0}".format(text), file=sys.stderr)
+    print("    ", line, file=sys.stderr)
+    print(" " * (line.find(text)+len(text)+3), "^", file=sys.stderr)
+
+def tokenize_lines(input, columns=None):
     """An iterator that returns lists of tokens, one for each line of the
-    iterable input sequence."""
-    return map(tokenize_line, input)
+    iterable input sequence.  If COLUMNS is a list, the list of columns of the
+    tokens on each line is appended to it as that line is tokenized."""
+    if columns is None:
+        return map(tokenize_line, input)
+    return tokenize_columns(input, columns)
+
+def tokenize_columns(input, columns):
+    """Tokenize each line of INPUT, appending its columns to COLUMNS."""
+    for line in input:
+        line_columns = []
+        tokens = tokenize_line(line, line_columns)
+        columns.append(line_columns)
+        yield tokens
 
 def count_tokens(input):
     """Count the number of non-delimiter tokens in input."""
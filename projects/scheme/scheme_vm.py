@@ -0,0 +1,507 @@
+"""This module implements a bytecode backend for the Scheme interpreter: a
+compiler from Scheme expressions to instructions for a stack machine, and the
+virtual machine that runs them.
+
+Compiled code uses the same environments and procedures as the evaluators in
+scheme.py.  Local variables are addressed by slot using the Scope computed at
+compile time, so values, frames, and procedures pass freely between compiled
+code and the other evaluators (for instance through eval and apply).
+
+The virtual machine keeps both its operand stack and its call stack in Python
+lists, so calls between compound procedures do not use the Python stack.
+
+Usage: python3 scheme.py -vm [FILE]
+"""
+
+from scheme import *
+from ucb import main
+
+###########
+# Opcodes #
+###########
+
+# Each instruction is an opcode followed by a single argument.
+(CONST, LOCAL0, LOCAL1, LOCAL, GLOBAL, NAME, DEFINE_SLOT, DEFINE_NAME, POP,
+ JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, MAKE_LAMBDA,
+ CALL, TAIL_CALL, RETURN, ENTER, LEAVE, RAISE) = range(20)
+
+OPNAMES = ["CONST", "LOCAL0", "LOCAL1", "LOCAL", "GLOBAL", "NAME",
+           "DEFINE_SLOT", "DEFINE_NAME", "POP", "JUMP", "JUMP_IF_FALSE",
+           "JUMP_IF_FALSE_OR_POP", "JUMP_IF_TRUE_OR_POP", "MAKE_LAMBDA",
+           "CALL", "TAIL_CALL", "RETURN", "ENTER", "LEAVE", "RAISE"]
+
+class Code:
+    """A sequence of instructions that runs in frames described by SCOPE.
+
+    >>> print(compile_expression(read_line("(if (< x 0) (- x) x)"), None))
+     0 GLOBAL      <
+     2 GLOBAL      x
+     4 CONST       0
+     6 CALL        2
+     8 JUMP_IF_FALSE 16
+    10 GLOBAL      -
+    12 GLOBAL      x
+    14 TAIL_CALL   1
+    16 GLOBAL      x
+    18 RETURN
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.instructions = []
+
+    def emit(self, op, arg=None):
+        """Append an instruction and return the position of its argument."""
+        self.instructions.append(op)
+        self.instructions.append(arg)
+        return len(self.instructions) - 1
+
+    def patch(self, position):
+        """Set the argument at POSITION to the position of the next
+        instruction, completing a forward jump."""
+        self.instructions[position] = len(self.instructions)
+
+    def __str__(self):
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            op, arg = self.instructions[pc], self.instructions[pc+1]
+            if op in (GLOBAL, LOCAL):
+                arg = arg[-1]
+            elif op == ENTER:
+                arg = arg[0]
+            elif op == MAKE_LAMBDA:
+                arg = "(lambda {0} ...)".format(arg[0])
+            elif arg is None:
+                arg = ""
+            lines.append("{0:2} {1:11} {2}".format(pc, OPNAMES[op], arg))
+        return "\n".join(line.rstrip() for line in lines)
+
+############
+# Compiler #
+############
+
+def compile_expression(expr, scope):
+    """Return the Code for the Scheme expression EXPR, which will be run in
+    frames described by SCOPE and returns the value of EXPR."""
+    code = Code(scope)
+    compile_expr(expr, scope, True, code)
+    return code
+
+def compile_procedure(procedure, parent):
+    """Return the Code for the body of the LambdaProcedure or MuProcedure
+    PROCEDURE, whose frames have the Scope PARENT as their parent."""
+    defined = scan_defines(procedure.body, [])
+    return compile_expression(procedure.body,
+                              Scope(procedure.formals, defined, parent))
+
+def compile_expr(expr, scope, tail, code):
+    """Append instructions to CODE that evaluate EXPR in SCOPE and push its
+    value. If TAIL is true, they instead return its value from the frame.
+    Malformed expressions raise a SchemeError only if they are evaluated."""
+    start = len(code.instructions)
+    try:
+        compile_form(expr, scope, tail, code)
+    except SchemeError as err:
+        del code.instructions[start:]
+        code.emit(RAISE, err)
+
+def compile_form(expr, scope, tail, code):
+    """Append instructions for EXPR to CODE (see compile_expr)."""
+    if expr is None:
+        raise SchemeError("Cannot evaluate an undefined expression.")
+
+    # Compile Atoms
+    if scheme_symbolp(expr):
+        compile_symbol(expr, scope, code)
+        finish(tail, code)
+    elif scheme_atomp(expr) or scheme_stringp(expr) or expr is okay:
+        code.emit(CONST, expr)
+        finish(tail, code)
+
+    # All non-atomic expressions are lists.
+    elif not scheme_listp(expr):
+        raise SchemeError("malformed list: {0}".format(str(expr)))
+    elif scheme_symbolp(expr.first) and expr.first in COMPILERS:
+        COMPILERS[expr.first](expr.second, scope, tail, code)
+    else:
+        compile_call(expr.first, expr.second, scope, tail, code)
+
+def finish(tail, code):
+    """Return from the frame if the value just pushed is in tail position."""
+    if tail:
+        code.emit(RETURN)
+
+def compile_symbol(symbol, scope, code):
+    """Append an instruction to CODE that pushes the value of SYMBOL."""
+    depth, slot = resolve(symbol, scope)
+    if depth is None:
+        code.emit(NAME, symbol)
+    elif slot is None:
+        code.emit(GLOBAL, (depth, symbol))
+    else:
+        for _ in range(depth):
+            scope = scope.parent
+        if slot < scope.num_formals and depth < 2:
+            code.emit(LOCAL1 if depth else LOCAL0, slot)
+        else:
+            code.emit(LOCAL, (depth, slot, symbol))
+
+def compile_body(exprs, scope, tail, code):
+    """Append instructions to CODE that evaluate the non-empty Scheme list of
+    expressions EXPRS in order, keeping the value of the last."""
+    while exprs.second is not nil:
+        compile_expr(exprs.first, scope, False, code)
+        code.emit(POP)
+        exprs = exprs.second
+    compile_expr(exprs.first, scope, tail, code)
+
+def compile_call(operator, operands, scope, tail, code):
+    """Append instructions to CODE that call OPERATOR on OPERANDS."""
+    compile_expr(operator, scope, False, code)
+    count = 0
+    while operands is not nil:
+        compile_expr(operands.first, scope, False, code)
+        operands = operands.second
+        count += 1
+    code.emit(TAIL_CALL if tail else CALL, count)
+
+def compile_lambda_form(vals, scope, tail, code):
+    """Compile a lambda form with parameters VALS."""
+    formals, body = lambda_parts(vals)
+    template = LambdaProcedure(formals, body, None)
+    code.emit(MAKE_LAMBDA, (formals, body, compile_procedure(template, scope)))
+    finish(tail, code)
+
+def compile_mu_form(vals, scope, tail, code):
+    """Compile a mu form with parameters VALS."""
+    formals, body = lambda_parts(vals)
+    procedure = MuProcedure(formals, body)
+    procedure.vm_code = compile_procedure(procedure, DYNAMIC)
+    code.emit(CONST, procedure)
+    finish(tail, code)
+
+def compile_define_form(vals, scope, tail, code):
+    """Compile a define form with parameters VALS."""
+    check_form(vals, 2)
+    target = vals[0]
+    if scheme_symbolp(target):
+        check_form(vals, 2, 2)
+        compile_expr(vals.second.first, scope, False, code)
+    elif isinstance(target, Pair):
+        target, rest = function_definition(vals)
+        compile_lambda_form(rest, scope, False, code)
+    else:
+        raise SchemeError("cannot define argument")
+    if scope is not None and scope is not DYNAMIC and target in scope.slots:
+        code.emit(DEFINE_SLOT, (scope.slots[target], target))
+    else:
+        code.emit(DEFINE_NAME, target)
+    finish(tail, code)
+
+def compile_define_memoized_form(vals, scope, tail, code):
+    """Compile a define-memoized form with parameters VALS."""
+    compile_define_form(memoized_definition(vals), scope, tail, code)
+
+def compile_delay_form(vals, scope, tail, code, chained=False):
+    """Compile a delay form with parameters VALS, as a call that makes a
+    promise from a procedure of no arguments."""
+    check_form(vals, 1, 1)
+    code.emit(CONST, MAKE_PROMISE)
+    compile_lambda_form(Pair(nil, vals), scope, False, code)
+    code.emit(CONST, chained)
+    code.emit(TAIL_CALL if tail else CALL, 2)
+
+def compile_delay_force_form(vals, scope, tail, code):
+    """Compile a delay-force form with parameters VALS."""
+    compile_delay_form(vals, scope, tail, code, True)
+
+def compile_cons_stream_form(vals, scope, tail, code):
+    """Compile a cons-stream form with parameters VALS."""
+    compile_expr(stream_pair(vals), scope, tail, code)
+
+def compile_quote_form(vals, scope, tail, code):
+    """Compile a quote form with parameters VALS."""
+    check_form(vals, 1, 1)
+    code.emit(CONST, vals.first)
+    finish(tail, code)
+
+def compile_let_form(vals, scope, tail, code):
+    """Compile a let form with parameters VALS."""
+    formals, values, body = let_parts(vals)
+    let_scope = Scope(formals, scan_defines(sequence(body), []), scope)
+    for value in values:
+        compile_expr(value, scope, False, code)
+    code.emit(ENTER, (len(values), let_scope))
+    compile_body(body, let_scope, tail, code)
+    if not tail:
+        code.emit(LEAVE)
+
+def compile_if_form(vals, scope, tail, code):
+    """Compile an if form with parameters VALS."""
+    check_form(vals, 2, 3)
+    compile_expr(vals.first, scope, False, code)
+    alternative = code.emit(JUMP_IF_FALSE)
+    compile_expr(vals.second.first, scope, tail, code)
+    if not tail:
+        end = code.emit(JUMP)
+    code.patch(alternative)
+    if vals.second.second is nil:
+        code.emit(CONST, okay)
+        finish(tail, code)
+    else:
+        compile_expr(vals.second.second.first, scope, tail, code)
+    if not tail:
+        code.patch(end)
+
+def compile_and_form(vals, scope, tail, code):
+    """Compile a short-circuited and form with parameters VALS."""
+    compile_short_circuit(vals, True, JUMP_IF_FALSE_OR_POP, scope, tail, code)
+
+def compile_or_form(vals, scope, tail, code):
+    """Compile a short-circuited or form with parameters VALS."""
+    compile_short_circuit(vals, False, JUMP_IF_TRUE_OR_POP, scope, tail, code)
+
+def compile_short_circuit(vals, empty, jump, scope, tail, code):
+    """Compile an and or or form with parameters VALS, whose value is EMPTY
+    when VALS is nil. Each operand but the last is followed by JUMP."""
+    if vals is nil:
+        code.emit(CONST, empty)
+        finish(tail, code)
+        return
+    ends = []
+    while vals.second is not nil:
+        compile_expr(vals.first, scope, False, code)
+        ends.append(code.emit(jump))
+        vals = vals.second
+    compile_expr(vals.first, scope, tail, code)
+    for end in ends:
+        code.patch(end)
+    if tail and ends:
+        code.emit(RETURN)  # Returns a short-circuited value
+
+def compile_cond_form(vals, scope, tail, code):
+    """Compile a cond form with parameters VALS."""
+    ends = []
+    num_clauses = len(vals)
+    for i, clause in enumerate(vals):
+        try:
+            check_form(clause, 1)
+            if clause.first is ELSE and i < num_clauses-1:
+                raise SchemeError("else must be last")
+            elif clause.first is ELSE and clause.second is nil:
+                raise SchemeError("badly formed else clause")
+        except SchemeError as err:
+            code.emit(RAISE, err)  # Reported only if the clause is reached
+            break
+        if clause.first is ELSE:
+            compile_body(clause.second, scope, tail, code)
+            if not tail:
+                ends.append(code.emit(JUMP))
+            break
+        compile_expr(clause.first, scope, False, code)
+        if clause.second is nil:
+            ends.append(code.emit(JUMP_IF_TRUE_OR_POP))
+        else:
+            skip = code.emit(JUMP_IF_FALSE)
+            compile_body(clause.second, scope, tail, code)
+            if not tail:
+                ends.append(code.emit(JUMP))
+            code.patch(skip)
+    else:
+        code.emit(CONST, okay)
+        finish(tail, code)
+    for end in ends:
+        code.patch(end)
+    if tail and ends:
+        code.emit(RETURN)  # Returns the value of a clause with no body
+
+def compile_begin_form(vals, scope, tail, code):
+    """Compile a begin form with parameters VALS."""
+    check_form(vals, 1)
+    compile_body(vals, scope, tail, code)
+
+COMPILERS = {
+        AND: compile_and_form,
+        BEGIN: compile_begin_form,
+        COND: compile_cond_form,
+        CONS_STREAM: compile_cons_stream_form,
+        DEFINE: compile_define_form,
+        DEFINE_MEMOIZED: compile_define_memoized_form,
+        DELAY: compile_delay_form,
+        DELAY_FORCE: compile_delay_force_form,
+        IF: compile_if_form,
+        LAMBDA: compile_lambda_form,
+        LET: compile_let_form,
+        MU: compile_mu_form,
+        OR: compile_or_form,
+        QUOTE: compile_quote_form,
+        }
+
+###################
+# Virtual Machine #
+###################
+
+def procedure_code(procedure):
+    """Return the Code for the body of the compound PROCEDURE, compiling it
+    the first time it is called by the virtual machine."""
+    code = getattr(procedure, "vm_code", None)
+    if code is None:
+        if isinstance(procedure, MuProcedure):
+            parent = DYNAMIC
+        else:
+            parent = frame_scope(procedure.env)
+        code = procedure.vm_code = compile_procedure(procedure, parent)
+    return code
+
+def make_promise(procedure, chained):
+    """Return a Promise whose value is returned by running the compiled body
+    of PROCEDURE, a LambdaProcedure of no arguments."""
+    code = procedure.vm_code
+    def compute():
+        return execute(code, bind_arguments(procedure.env, code.scope, []))
+    return Promise(compute, chained)
+
+MAKE_PROMISE = PrimitiveProcedure(make_promise)
+
+def execute(code, env):
+    """Run CODE in environment ENV and return the value that it returns."""
+    instructions = code.instructions
+    stack = []
+    calls = []   # (instructions, pc, env) to resume after each active call
+    pc = 0
+    while True:
+        op, arg = instructions[pc], instructions[pc+1]
+        pc += 2
+        if op == LOCAL0:
+            stack.append(env.values[arg])
+        elif op == GLOBAL:
+            depth, symbol = arg
+            frame = env
+            for _ in range(depth):
+                # Names outside a Scope, such as those defined by eval
+                if frame.extras and symbol in frame.extras:
+                    stack.append(frame.extras[symbol])
+                    break
+                frame = frame.parent
+            else:
+                try:
+                    stack.append(frame.bindings[symbol])
+                except KeyError:
+                    stack.append(env.lookup(symbol))
+        elif op == CONST:
+            stack.append(arg)
+        elif op == CALL or op == TAIL_CALL:
+            stats.steps += 1
+            start = len(stack) - arg
+            procedure, args = stack[start-1], stack[start:]
+            del stack[start-1:]
+            if isinstance(procedure, PrimitiveProcedure):
+                if arg in procedure.direct_arity:
+                    value = procedure.fn(*args)
+                else:
+                    value = procedure.apply(args, env)
+                if op == CALL:
+                    stack.append(value)
+                    continue
+                if not calls:
+                    return value
+                instructions, pc, env = calls.pop()
+                stack.append(value)
+                continue
+            elif isinstance(procedure, LambdaProcedure):
+                parent = procedure.env
+            elif isinstance(procedure, MuProcedure):
+                parent = env
+            else:
+                raise SchemeError("Cannot call {0}".format(str(procedure)))
+            body = procedure_code(procedure)
+            stats.applications += 1
+            if op == CALL:
+                calls.append((instructions, pc, env))
+            else:
+                stats.tail_calls += 1
+            env = bind_arguments(parent, body.scope, args)
+            instructions, pc = body.instructions, 0
+        elif op == RETURN:
+            if not calls:
+                return stack.pop()
+            instructions, pc, env = calls.pop()
+        elif op == JUMP_IF_FALSE:
+            if stack.pop() is False:
+                pc = arg
+        elif op == LOCAL1:
+            stack.append(env.parent.values[arg])
+        elif op == JUMP:
+            pc = arg
+        elif op == POP:
+            stack.pop()
+        elif op == LOCAL:
+            depth, slot, symbol = arg
+            frame = env
+            for _ in range(depth):
+                frame = frame.parent
+            value = frame.values[slot]
+            if value is unassigned:
+                value = frame.parent.lookup(symbol)
+            stack.append(value)
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1] is False:
+                pc = arg
+            else:
+                stack.pop()
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1] is not False:
+                pc = arg
+            else:
+                stack.pop()
+        elif op == ENTER:
+            n, scope = arg
+            values = stack[len(stack)-n:]
+            del stack[len(stack)-n:]
+            values.extend([unassigned] * (scope.size - n))
+            env = CallFrame(env, scope, values)
+        elif op == LEAVE:
+            env = env.parent
+        elif op == MAKE_LAMBDA:
+            formals, body, lambda_code = arg
+            procedure = LambdaProcedure(formals, body, env)
+            procedure.vm_code = lambda_code
+            stack.append(procedure)
+        elif op == DEFINE_SLOT:
+            slot, symbol = arg
+            env.values[slot] = stack.pop()
+            stack.append(symbol)
+        elif op == DEFINE_NAME:
+            env.define(arg, stack.pop())
+            stack.append(arg)
+        elif op == NAME:
+            stack.append(env.lookup(arg))
+        elif op == RAISE:
+            raise arg.with_traceback(None)
+        else:
+            raise SchemeError("unknown opcode: {0}".format(op))
+
+def scheme_vm_eval(expr, env):
+    """Evaluate Scheme expression EXPR in environment ENV by compiling it and
+    running the resulting Code on the virtual machine.
+
+    >>> env = create_global_frame()
+    >>> scheme_vm_eval(read_line("(define (f n) (if (= n 0) 0 (+ n (f (- n 1)))))"), env)
+    'f'
+    >>> scheme_vm_eval(read_line("(f 5000)"), env)
+    12502500
+    """
+    return execute(compile_expression(expr, frame_scope(env)), env)
+
+@main
+def run(*argv):
+    """Print the instructions compiled from each expression in the input."""
+    while True:
+        try:
+            src = buffer_input("compile> ")
+            while src.more_on_line:
+                print(compile_expression(scheme_read(src), None))
+        except (SchemeError, SyntaxError, ValueError) as err:
+            print("Error:", err)
+        except (KeyboardInterrupt, EOFError):  # <Control>-D, etc.
+            return
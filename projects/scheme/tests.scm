@@ -542,6 +542,26 @@ one-through-four
 (cons 5 one-through-four)
 ; expect (5 1 2 3 4)
 
+;; Built-in higher-order list procedures (questions.scm redefines map and
+;; filter in Scheme)
+(reduce + 0 '(1 2 3 4))
+; expect 10
+(reduce (lambda (x acc) (cons x acc)) nil '(1 2 3))
+; expect (3 2 . 1)
+(for-each display '(1 2 3))
+; expect 123okay
+(for-each display)
+; expect Error
+(list-sort (lambda (a b) (< (car a) (car b))) '((2 a) (1 b) (2 c) (0 d)))
+; expect ((0 d) (1 b) (2 a) (2 c))
+(list-tail '(1 2 3 4) 2)
+; expect (3 4)
+(list-tail '(1 2) 3)
+; expect Error
+(define many (vector->list (make-vector 5000 1)))
+(reduce + 0 (list-sort > many))
+; expect 5000
+
 (define (map proc items)
   (if (null? items)
       nil
@@ -644,6 +664,25 @@ one-through-four
 (memq 'apple '(x (apple sauce) y apple pear))
 ; expect (apple pear)
 
+; Identity, equivalence and structural equality
+(eq? '(1 2) '(1 2))
+; expect False
+(eq? 'a 'a)
+; expect True
+(eqv? 2 2.0)
+; expect False
+(eq? 2 2.0)
+; expect False
+(eqv? 100000 (* 1000 100))
+; expect True
+(define (range-list n)
+  (define (build k s) (if (= k 0) s (build (- k 1) (cons k s))))
+  (build n nil))
+(equal? (range-list 2000) (range-list 2000))
+; expect True
+(equal? (range-list 2000) (cons 0 (range-list 1999)))
+; expect False
+
 (define (equal? x y)
   (cond ((pair? x) (and (pair? y)
                         (equal? (car x) (car y))
@@ -767,6 +806,9 @@ one-through-four
       (12))
 ; expect 12
 
+(cond (12 'reached) car)
+; expect reached
+
 ((lambda (x) (display x) (newline) x) 2)
 ; expect 2 ; 2
 
@@ -816,3 +858,124 @@ one-through-four
     (sum (- n 1) (+ n total))))
 (sum 1001 0)
 ; expect 501501
+
+; A file is required only once in each global environment
+(require 'questions)
+; expect okay
+(require "questions")
+; expect okay
+(length (load-graph))
+; expect 1
+
+; Counters of evaluator work
+(reset-stats)
+; expect okay
+(map car (runtime-stats))
+; expect (steps applications frames pairs tail-calls peak-depth peak-stack)
+(integer? (recursion-depth))
+; expect True
+
+; Memoized procedures remember the values of equal arguments
+(define-memoized (count-partitions n m)
+  (cond ((= n 0) 1)
+        ((or (< n 0) (= m 0)) 0)
+        (else (+ (count-partitions (- n m) m)
+                 (count-partitions n (- m 1))))))
+(count-partitions 100 100)
+; expect 190569292
+(define last-two (memoize (lambda (s) (length s)) 2))
+(last-two '(1 2))
+; expect 2
+(last-two (list 1 2))
+; expect 2
+(last-two '(3))
+; expect 1
+(memo-stats last-two)
+; expect ((hits . 1) (misses . 2) (size . 2) (capacity . 2))
+(define-memoized (kind x) (if (eq? x #t) 'bool 'num))
+(list (kind 1) (kind #t) (kind 1.0))
+; expect (num bool num)
+(memo-stats kind)
+; expect ((hits . 0) (misses . 3) (size . 3) (capacity . False))
+(define (nest k s) (if (= k 0) s (nest (- k 1) (list s))))
+(define deep-key (memoize (lambda (s) 'deep)))
+(list (deep-key (nest 2000 1)) (deep-key (nest 2000 1)))
+; expect (deep deep)
+(cdr (car (memo-stats deep-key)))
+; expect 1
+(memoize 3)
+; expect Error
+
+; Vectors and hash tables
+(define v (make-vector 3 0))
+(vector-set! v 1 'a)
+; expect okay
+v
+; expect #(0 a 0)
+(list (vector-ref v 1) (vector-length v))
+; expect (a 3)
+(vector-ref v 3)
+; expect Error
+(vector 1 (list 2))
+; expect #(1 (2))
+(vector->list (list->vector '(1 2 3)))
+; expect (1 2 3)
+(define table (make-hash-table))
+(hash-set! table '(1 2) 'pair)
+; expect okay
+(hash-ref table (list 1 2))
+; expect pair
+(hash-ref table 'missing 0)
+; expect 0
+(hash-set! table 1 'one)
+; expect okay
+(list (hash-ref table #t 'none) (hash-ref table 1.0 'none)
+      (hash-ref table 1) (hash-ref table '(#t 2) 'none))
+; expect (none none one none)
+(hash-ref table 'missing)
+; expect Error
+(hash-set! table v 1)
+; expect Error
+
+; Streams and promises
+(define (integers-from n) (cons-stream n (integers-from (+ n 1))))
+(define nat (integers-from 0))
+nat
+; expect (0 . #[promise (not forced)])
+(stream-car (stream-cdr (stream-cdr nat)))
+; expect 2
+nat
+; expect (0 . #[promise (forced)])
+(define (stream-ref s k)
+  (if (= k 0) (stream-car s) (stream-ref (stream-cdr s) (- k 1))))
+(stream-ref nat 3000)
+; expect 3000
+(define forced (make-vector 1 0))
+(define p (delay (begin (vector-set! forced 0 (+ (vector-ref forced 0) 1))
+                        (vector-ref forced 0))))
+(list (force p) (force p))
+; expect (1 1)
+(define (drop s k)
+  (if (= k 0) s (delay-force (drop (stream-cdr s) (- k 1)))))
+(stream-car (force (drop nat 5000)))
+; expect 5000
+(force 3)
+; expect 3
+
+; Parallel map in worker processes
+(define (square x) (* x x))
+(parallel-map square '(1 2 3 4 5) 2)
+; expect (1 4 9 16 25)
+(parallel-map (lambda (x) (/ 1 x)) '(1 0) 2)
+; expect Error
+(parallel-map square)
+; expect Error
+
+; Internal defines seen by procedures applied from primitives
+(define shadowed 'global)
+(define (outer) (define shadowed 'local) ((memoize (lambda (y) shadowed)) 1))
+(outer)
+; expect local
+(define (define-by-eval) (eval '(define shadowed 'evaled)) shadowed)
+(define-by-eval)
+; expect evaled